@@ -1,5 +1,7 @@
+import atexit
 from datetime import datetime
 from agent_core import chiedi_all_agente, esegui_azione
+import gestione_db
 
 def salva_log(messaggio_utente, risposta_agente):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -7,6 +9,7 @@ def salva_log(messaggio_utente, risposta_agente):
         file.write(f"[{timestamp}] Utente: {messaggio_utente} | Agente: {risposta_agente}\n")
 
 if __name__ == "__main__":
+    atexit.register(gestione_db.chiudi_connessioni)
     print("  - v1.0 OBS3SSION")
     print("Scrivi 'esci' per terminare.")
 
@@ -1,9 +1,16 @@
 import requests
 import json
 import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import gestione_file
 import gestione_db
+import gestione_http
+import gestione_cache
+import gestione_intenti
 
 # Inizializza il database
 gestione_db.inizializza_db()
@@ -22,27 +29,128 @@ except Exception as e:
     print(f"Errore nel caricamento del SYSTEM_PROMPT: {e}")
     SYSTEM_PROMPT = "Sei un assistente AI utile e cordiale."
 
-# Cache per memorizzare le risposte precedenti (opzionale)
-response_cache = {}
+# Cache LRU con scadenza per le risposte deterministiche (temperature 0)
+response_cache = gestione_cache.CacheRisposte(
+    max_voci=int(os.getenv("LLM_CACHE_MAX_VOCI", "1000")),
+    max_byte=int(os.getenv("LLM_CACHE_MAX_MB", "32")) * 1024 * 1024,
+    ttl=int(os.getenv("LLM_CACHE_TTL", "3600"))
+)
+
+# Livello persistente opzionale (SQLite accanto a database.sqlite) che sopravvive ai riavvii
+cache_persistente = None
+if os.getenv("LLM_CACHE_PERSISTENTE", "0") == "1":
+    try:
+        cache_persistente = gestione_cache.CachePersistente(
+            os.path.join(os.path.dirname(gestione_db.DB_PATH), "cache_llm.sqlite"),
+            max_voci=int(os.getenv("LLM_CACHE_PERSISTENTE_MAX_VOCI", "20000")),
+            max_byte=int(os.getenv("LLM_CACHE_PERSISTENTE_MAX_MB", "256")) * 1024 * 1024,
+            ttl=int(os.getenv("LLM_CACHE_PERSISTENTE_TTL", str(7 * 24 * 3600)))
+        )
+        cache_persistente.pulisci()
+        # Precarica in memoria le risposte più richieste
+        for chiave_calda, valore_caldo in cache_persistente.voci_calde(int(os.getenv("LLM_CACHE_PRECARICA", "200"))):
+            response_cache.set(chiave_calda, valore_caldo)
+    except Exception as e:
+        print(f"Errore nell'apertura della cache persistente: {e}")
+        cache_persistente = None
+
+# Politica di retry e circuit breaker verso il provider LLM
+politica_retry = gestione_http.PoliticaRetry(
+    base=float(os.getenv("LLM_RETRY_BASE", "0.5")),
+    massimo=float(os.getenv("LLM_RETRY_MASSIMO", "8")),
+    budget=float(os.getenv("LLM_RETRY_BUDGET", "40"))
+)
+circuito_llm = gestione_http.CircuitBreaker(
+    soglia=int(os.getenv("LLM_CIRCUITO_SOGLIA", "5")),
+    tempo_apertura=float(os.getenv("LLM_CIRCUITO_APERTURA", "30"))
+)
+
+# Richieste identiche in corso, condivise tra i chiamanti concorrenti
+richieste_in_volo = gestione_cache.SingleFlight()
+
+# Stato della conversazione corrente (es. opzioni proposte in attesa di scelta)
+stato_sessione = {}
+
+# Pagina successiva in sospeso per conversazione: l'id di sessione arriva dalla pagina web
+# (una per scheda), None è la CLI. Le voci più vecchie scadono o vengono scartate.
+pagine_in_sospeso = gestione_cache.CacheRisposte(max_voci=1000, ttl=3600)
+
+# "altro" prosegue l'ultima consultazione paginata della stessa conversazione;
+# senza pagine in sospeso decide l'LLM
+gestione_intenti.router.regola(
+    "pagina_successiva",
+    r"(?:altro|altre righe|continua|pagina successiva|avanti)",
+    lambda m, sessione: pagine_in_sospeso.get(sessione),
+    per_sessione=True
+)
 
 # Endpoint 
 API_ENDPOINT = "https://openrouter.ai/api/v1/chat/completions"
 
+# Executor per le operazioni bloccanti (SQLite, file) chiamate dall'API asincrona
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_EXECUTOR_WORKERS", "8")),
+    thread_name_prefix="agente"
+)
 
-def chiedi_all_agente(messaggio_utente, temperature=0.7, max_retries=3):
-    """
-    Invia una richiesta all'API con il messaggio utente e restituisce la risposta JSON.
-    Implementa caching e retry in caso di errori.
-    """
-    if temperature == 0 and messaggio_utente in response_cache:
-        return response_cache[messaggio_utente]
 
-    headers = {
+def _intestazioni():
+    """Header HTTP comuni a tutte le chiamate verso l'API"""
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
         "HTTP-Referer": "http://localhost:5000",
         "X-Title": "Python Chat Application"
     }
+
+
+def _chiave_cache(messaggio_utente, temperature):
+    """Chiave di cache per modello, SYSTEM_PROMPT, temperatura e messaggio normalizzato"""
+    return gestione_cache.chiave_cache(DEFAULT_MODEL, SYSTEM_PROMPT, temperature, messaggio_utente)
+
+
+def _leggi_cache(chiave):
+    """Cerca la risposta in memoria e poi, se attivo, nel livello su disco"""
+    risposta = response_cache.get(chiave)
+    if risposta is None and cache_persistente is not None:
+        risposta = cache_persistente.get(chiave)
+        if risposta is not None:
+            response_cache.set(chiave, risposta)
+    return risposta
+
+
+def _scrivi_cache(chiave, risposta):
+    response_cache.set(chiave, risposta)
+    if cache_persistente is not None:
+        try:
+            cache_persistente.set(chiave, risposta)
+        except Exception as e:
+            print(f"[DEBUG] Errore nella scrittura della cache persistente: {e}")
+
+
+async def _leggi_cache_async(chiave):
+    """
+    _leggi_cache per l'API asincrona: la memoria si legge subito, il livello su disco
+    (SELECT + UPDATE + COMMIT) gira sull'executor per non bloccare l'event loop
+    """
+    risposta = response_cache.get(chiave)
+    if risposta is None and cache_persistente is not None:
+        loop = asyncio.get_running_loop()
+        risposta = await loop.run_in_executor(_executor, _leggi_cache, chiave)
+    return risposta
+
+
+async def _scrivi_cache_async(chiave, risposta):
+    """_scrivi_cache per l'API asincrona, con la scrittura su disco sull'executor"""
+    if cache_persistente is None:
+        _scrivi_cache(chiave, risposta)
+        return
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _scrivi_cache, chiave, risposta)
+
+
+def _payload(messaggio_utente, temperature, stream=False):
+    """Corpo della richiesta di completamento per il messaggio utente"""
     payload = {
         "model": DEFAULT_MODEL,
         "messages": [
@@ -52,44 +160,405 @@ def chiedi_all_agente(messaggio_utente, temperature=0.7, max_retries=3):
         "temperature": temperature,
         "max_tokens": 4096
     }
+    if stream:
+        payload["stream"] = True
+    return payload
 
-    for tentativo in range(max_retries):
-        try:
-            response = requests.post(API_ENDPOINT, headers=headers, json=payload, timeout=30)
-            print(f"[DEBUG] Tentativo {tentativo+1} - Stato HTTP: {response.status_code}")
-            response.raise_for_status()
-            data = response.json()
-            risposta = data["choices"][0]["message"]["content"]
+
+def chiedi_all_agente(messaggio_utente, temperature=0.7, max_retries=3, sessione=None):
+    """
+    Invia una richiesta all'API con il messaggio utente e restituisce la risposta JSON.
+    Implementa caching e retry in caso di errori.
+    I comandi semplici riconosciuti dal router locale non passano dall'API;
+    'sessione' identifica la conversazione per i comandi che dipendono dal suo stato (es. "altro").
+    """
+    azione_locale = gestione_intenti.interpreta(messaggio_utente, sessione)
+    if azione_locale is not None:
+        return azione_locale
+
+    chiave = _chiave_cache(messaggio_utente, temperature)
+    if temperature == 0:
+        risposta = _leggi_cache(chiave)
+        if risposta is not None:
+            return risposta
+
+    # Se la stessa richiesta è già in corso (altra scheda o altro utente) ne attende il risultato
+    return richieste_in_volo.esegui(
+        chiave,
+        lambda: _richiedi_completamento(messaggio_utente, temperature, max_retries, chiave)
+    )
+
+
+def _errore_api(testo):
+    """Risposta di errore nello stesso formato JSON delle azioni dell'agente"""
+    return json.dumps({"azione": "rispondi", "risposta_testuale": testo})
+
+
+def _errore_circuito():
+    return _errore_api(
+        "Servizio LLM temporaneamente non disponibile dopo errori ripetuti. "
+        f"Riprova tra {circuito_llm.secondi_alla_riapertura():.0f} secondi."
+    )
+
+
+def _errore_richiesta(eccezione, status_code):
+    """Messaggio per una richiesta fallita senza altri tentativi possibili"""
+    if status_code == 404:
+        return _errore_api(f"ERRORE: Endpoint non trovato. Verifica l'URL: {API_ENDPOINT}")
+    return _errore_api(f"Errore API: {str(eccezione)} - Status: {status_code or 'N/A'}")
+
+
+def _tentativi(max_tentativi=None):
+    return gestione_http.Tentativi(politica_retry, circuito_llm, max_tentativi)
+
+
+def _richiedi_completamento(messaggio_utente, temperature, max_retries, chiave):
+    """Esegue la chiamata HTTP all'API con i tentativi di retry"""
+    if not circuito_llm.consenti():
+        return _errore_circuito()
+
+    headers = _intestazioni()
+    payload = _payload(messaggio_utente, temperature)
+
+    with _tentativi(max_retries) as tentativi:
+        for tentativo in tentativi:
+            status_code = None
+            retry_after = None
+            try:
+                response = gestione_http.sessione().post(API_ENDPOINT, headers=headers, json=payload, timeout=30)
+                status_code = response.status_code
+                print(f"[DEBUG] Tentativo {tentativo+1} - Stato HTTP: {status_code}")
+                retry_after = gestione_http.leggi_retry_after(response.headers.get("Retry-After"))
+                response.raise_for_status()
+                risposta = response.json()["choices"][0]["message"]["content"]
+            except (KeyError, json.JSONDecodeError) as e:
+                tentativi.successo()
+                return _errore_api(f"Errore nel parsing della risposta: {str(e)}")
+            except requests.RequestException as e:
+                attesa = tentativi.fallimento(tentativo, status_code, e, retry_after)
+                if attesa is None:
+                    return _errore_richiesta(e, status_code)
+                time.sleep(attesa)
+                continue
+            tentativi.successo()
+            if temperature == 0:
+                _scrivi_cache(chiave, risposta)
+            return risposta
+
+
+async def chiedi_all_agente_async(messaggio_utente, temperature=0.7, max_retries=3, sessione=None):
+    """
+    Versione asincrona di chiedi_all_agente: usa un client HTTP non bloccante,
+    così l'event loop può servire altre sessioni durante l'attesa dell'LLM.
+    """
+    azione_locale = gestione_intenti.interpreta(messaggio_utente, sessione)
+    if azione_locale is not None:
+        return azione_locale
+
+    chiave = _chiave_cache(messaggio_utente, temperature)
+    if temperature == 0:
+        risposta = await _leggi_cache_async(chiave)
+        if risposta is not None:
+            return risposta
+
+    # Come nella versione sincrona, le richieste identiche in corso sullo stesso event loop si attendono
+    return await richieste_in_volo.esegui_async(
+        chiave,
+        lambda: _richiedi_completamento_async(messaggio_utente, temperature, max_retries, chiave)
+    )
+
+
+async def _richiedi_completamento_async(messaggio_utente, temperature, max_retries, chiave):
+    """Esegue la chiamata HTTP asincrona all'API con i tentativi di retry"""
+    if not circuito_llm.consenti():
+        return _errore_circuito()
+
+    httpx = gestione_http.httpx
+    headers = _intestazioni()
+    payload = _payload(messaggio_utente, temperature)
+
+    with _tentativi(max_retries) as tentativi:
+        client = gestione_http.client_async()
+        for tentativo in tentativi:
+            status_code = None
+            retry_after = None
+            try:
+                response = await client.post(API_ENDPOINT, headers=headers, json=payload, timeout=30)
+                status_code = response.status_code
+                print(f"[DEBUG] Tentativo {tentativo+1} - Stato HTTP: {status_code}")
+                retry_after = gestione_http.leggi_retry_after(response.headers.get("Retry-After"))
+                response.raise_for_status()
+                risposta = response.json()["choices"][0]["message"]["content"]
+            except (KeyError, json.JSONDecodeError) as e:
+                tentativi.successo()
+                return _errore_api(f"Errore nel parsing della risposta: {str(e)}")
+            except httpx.HTTPError as e:
+                attesa = tentativi.fallimento(tentativo, status_code, e, retry_after)
+                if attesa is None:
+                    return _errore_richiesta(e, status_code)
+                await asyncio.sleep(attesa)
+                continue
+            tentativi.successo()
             if temperature == 0:
-                response_cache[messaggio_utente] = risposta
+                await _scrivi_cache_async(chiave, risposta)
             return risposta
-        except requests.RequestException as e:
-            if hasattr(response, "status_code") and response.status_code == 404:
-                return json.dumps({
-                    "azione": "rispondi",
-                    "risposta_testuale": f"ERRORE: Endpoint non trovato. Verifica l'URL: {API_ENDPOINT}"
-                })
-            if tentativo < max_retries - 1:
-                print(f"Errore rete, ritentando... ({tentativo+1}/{max_retries})")
+
+
+class EstrattoreTestoRisposta:
+    """
+    Estrae in modo incrementale il valore di "risposta_testuale" (al primo livello
+    del JSON) mentre il testo del modello arriva a pezzi.
+    feed() restituisce solo i caratteri nuovi già decodificati.
+    """
+
+    def __init__(self):
+        self.profondita = 0
+        self.in_stringa = False
+        self.escape = False
+        self.unicode_pendente = None
+        self.surrogato_alto = None
+        self.stringa_corrente = []
+        self.ultima_chiave = None
+        self.attende_valore = False
+        self.in_valore = False
+        self.completato = False
+
+    def feed(self, pezzo):
+        uscita = []
+        for c in pezzo:
+            if self.in_stringa:
+                if self.unicode_pendente is not None:
+                    self.unicode_pendente += c
+                    if len(self.unicode_pendente) == 4:
+                        try:
+                            codice = int(self.unicode_pendente, 16)
+                        except ValueError:
+                            codice = None
+                        self.unicode_pendente = None
+                        self._aggiungi_codice(codice, uscita)
+                elif self.escape:
+                    self.escape = False
+                    if c == "u":
+                        self.unicode_pendente = ""
+                    else:
+                        mappa = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+                        self._aggiungi(mappa.get(c, c), uscita)
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self._chiudi_surrogato(uscita)
+                    self.in_stringa = False
+                    if self.in_valore:
+                        self.in_valore = False
+                        self.completato = True
+                    elif self.profondita == 1 and not self.attende_valore:
+                        self.ultima_chiave = "".join(self.stringa_corrente)
+                    self.attende_valore = False
+                else:
+                    self._aggiungi(c, uscita)
                 continue
+
+            if c == '"':
+                self.in_stringa = True
+                self.stringa_corrente = []
+                if (self.attende_valore and self.profondita == 1
+                        and self.ultima_chiave == "risposta_testuale" and not self.completato):
+                    self.in_valore = True
+            elif c in "{[":
+                self.profondita += 1
+                self.attende_valore = False
+            elif c in "}]":
+                self.profondita -= 1
+            elif c == ":":
+                self.attende_valore = True
+            elif c == ",":
+                self.attende_valore = False
+                self.ultima_chiave = None
+        return "".join(uscita)
+
+    def _aggiungi_codice(self, codice, uscita):
+        """
+        Carattere di un escape \\uXXXX. I caratteri fuori dal piano base (es. emoji) arrivano come
+        coppia di surrogati in due escape consecutivi: vanno ricomposti, perché un surrogato isolato
+        non è codificabile in UTF-8. Surrogati spaiati diventano U+FFFD.
+        """
+        if codice is None:
+            self._aggiungi("", uscita)
+        elif 0xD800 <= codice <= 0xDBFF:
+            self._chiudi_surrogato(uscita)
+            self.surrogato_alto = codice
+        elif 0xDC00 <= codice <= 0xDFFF:
+            if self.surrogato_alto is None:
+                self._aggiungi("\ufffd", uscita)
             else:
-                return json.dumps({
-                    "azione": "rispondi",
-                    "risposta_testuale": f"Errore API: {str(e)} - Status: {getattr(response, 'status_code', 'N/A')}"
-                })
-        except (KeyError, json.JSONDecodeError) as e:
-            return json.dumps({
-                "azione": "rispondi",
-                "risposta_testuale": f"Errore nel parsing della risposta: {str(e)}"
-            })
-
-
-def esegui_azione(risposta_agente):
+                carattere = chr(0x10000 + ((self.surrogato_alto - 0xD800) << 10) + (codice - 0xDC00))
+                self.surrogato_alto = None
+                self._aggiungi(carattere, uscita)
+        else:
+            self._aggiungi(chr(codice), uscita)
+
+    def _chiudi_surrogato(self, uscita):
+        """Un surrogato alto non seguito dal suo surrogato basso viene sostituito con U+FFFD"""
+        if self.surrogato_alto is not None:
+            self.surrogato_alto = None
+            self._scrivi("\ufffd", uscita)
+
+    def _aggiungi(self, carattere, uscita):
+        self._chiudi_surrogato(uscita)
+        self._scrivi(carattere, uscita)
+
+    def _scrivi(self, carattere, uscita):
+        if self.in_valore:
+            uscita.append(carattere)
+        else:
+            self.stringa_corrente.append(carattere)
+
+
+def chiedi_all_agente_stream(messaggio_utente, temperature=0.7, sessione=None):
+    """
+    Versione in streaming di chiedi_all_agente.
+    Genera tuple ("testo", frammento) man mano che arriva "risposta_testuale"
+    e, alla fine, ("completo", risposta_json) con la risposta intera da passare a esegui_azione.
+    """
+    azione_locale = gestione_intenti.interpreta(messaggio_utente, sessione)
+    if azione_locale is not None:
+        yield ("completo", azione_locale)
+        return
+
+    chiave = _chiave_cache(messaggio_utente, temperature)
+    risposta = _leggi_cache(chiave) if temperature == 0 else None
+    if risposta is not None:
+        testo = EstrattoreTestoRisposta().feed(risposta)
+        if testo:
+            yield ("testo", testo)
+        yield ("completo", risposta)
+        return
+
+    # Più schede che inviano lo stesso comando condividono un solo stream: chi arriva dopo
+    # riceve i frammenti già generati e poi gli altri man mano che arrivano
+    try:
+        yield from richieste_in_volo.esegui_stream(
+            chiave,
+            lambda: _completamento_stream(messaggio_utente, temperature, chiave)
+        )
+    except gestione_cache.VoloInterrotto as e:
+        yield ("completo", _errore_api(f"{e}, riprova."))
+
+
+def _completamento_stream(messaggio_utente, temperature, chiave):
+    """Chiamata in streaming all'API con i tentativi di retry; genera le stesse tuple di chiedi_all_agente_stream"""
+    if not circuito_llm.consenti():
+        yield ("completo", _errore_circuito())
+        return
+
+    estrattore = EstrattoreTestoRisposta()
+    parti = []
+    with _tentativi() as tentativi:
+        for tentativo in tentativi:
+            status_code = None
+            retry_after = None
+            try:
+                with gestione_http.sessione().post(
+                    API_ENDPOINT,
+                    headers=_intestazioni(),
+                    json=_payload(messaggio_utente, temperature, stream=True),
+                    timeout=30,
+                    stream=True
+                ) as response:
+                    status_code = response.status_code
+                    print(f"[DEBUG] Stream - Stato HTTP: {status_code}")
+                    retry_after = gestione_http.leggi_retry_after(response.headers.get("Retry-After"))
+                    response.raise_for_status()
+                    # Gli eventi SSE sono sempre UTF-8; senza charset requests userebbe ISO-8859-1 per text/*
+                    response.encoding = "utf-8"
+                    for linea in response.iter_lines(decode_unicode=True):
+                        # Le righe che iniziano con ":" sono commenti keep-alive del provider
+                        if not linea or not linea.startswith("data:"):
+                            continue
+                        dato = linea[len("data:"):].strip()
+                        if dato == "[DONE]":
+                            break
+                        evento = json.loads(dato)
+                        if "error" in evento:
+                            raise requests.RequestException(evento["error"].get("message", str(evento["error"])))
+                        scelte = evento.get("choices") or []
+                        if not scelte:
+                            continue
+                        frammento = (scelte[0].get("delta") or {}).get("content") or ""
+                        if not frammento:
+                            continue
+                        parti.append(frammento)
+                        testo = estrattore.feed(frammento)
+                        if testo:
+                            yield ("testo", testo)
+                tentativi.successo()
+                break
+            except (KeyError, json.JSONDecodeError) as e:
+                tentativi.successo()
+                yield ("completo", _errore_api(f"Errore nel parsing della risposta: {str(e)}"))
+                return
+            except requests.RequestException as e:
+                # Si può ritentare solo se al client non è ancora arrivato nulla
+                attesa = tentativi.fallimento(tentativo, status_code, e, retry_after, ritenta=not parti)
+                if attesa is None:
+                    yield ("completo", _errore_richiesta(e, status_code))
+                    return
+                time.sleep(attesa)
+
+    risposta = "".join(parti)
+    if temperature == 0:
+        _scrivi_cache(chiave, risposta)
+    yield ("completo", risposta)
+
+
+# Fase di avanzamento riportata al client per ogni azione
+FASI_AZIONI = {
+    "consulta_tabella": ("db", "Interrogo il database..."),
+    "aggrega_tabella": ("db", "Calcolo le aggregazioni nel database..."),
+    "elenca_tabelle": ("db", "Leggo l'elenco delle tabelle..."),
+    "descrivi_tabella": ("db", "Leggo la struttura della tabella..."),
+    "crea_tabella": ("db", "Creo la tabella..."),
+    "inserisci_dati": ("db", "Inserisco i dati..."),
+    "aggiorna_dati": ("db", "Aggiorno i dati..."),
+    "elimina_dati": ("db", "Elimino i dati..."),
+    "elimina_tabella": ("db", "Elimino la tabella..."),
+    "modifica_tabella": ("db", "Modifico la tabella..."),
+    "suggerisci_indici": ("db", "Analizzo le query eseguite..."),
+    "crea_indice": ("db", "Creo l'indice..."),
+    "elenca_indici": ("db", "Leggo gli indici..."),
+    "elimina_indice": ("db", "Elimino l'indice..."),
+    "esporta_tabella": ("esportazione", "Esporto la tabella..."),
+    "importa_tabella": ("importazione", "Importo il file nella tabella..."),
+    "esporta_database": ("esportazione", "Esporto le tabelle in parallelo..."),
+}
+
+
+def _notifica(progresso, fase, messaggio, **dettagli):
+    """Invia un aggiornamento di avanzamento al callback, se presente"""
+    if progresso is None:
+        return
+    try:
+        progresso({"fase": fase, "messaggio": messaggio, **dettagli})
+    except Exception as e:
+        print(f"[DEBUG] Errore nella notifica di avanzamento: {e}")
+
+
+def esegui_azione(risposta_agente, progresso=None, sessione=None):
     """
     Interpreta la risposta JSON dell'agente e chiama la funzione corretta di gestione_file o gestione_db.
     Ritorna sempre una stringa da mostrare all'utente.
     Supporta azioni atomiche e piani multi-step (Hybrid Planner).
+    Se 'progresso' è un callback, riceve un dizionario {"fase", "messaggio", ...} per ogni fase eseguita.
+    'sessione' è la conversazione a cui legare la pagina successiva di consulta_tabella.
+    Alla fine la connessione al database usata dall'azione torna nel pool.
     """
+    try:
+        return _esegui_azione(risposta_agente, progresso, sessione)
+    finally:
+        gestione_db.connessioni.restituisci()
+
+
+def _esegui_azione(risposta_agente, progresso=None, sessione=None):
     # Se la risposta è una stringa JSON, convertila
     if isinstance(risposta_agente, str):
         try:
@@ -101,7 +570,11 @@ def esegui_azione(risposta_agente):
 
     # Se è un piano, esegui tutti gli step
     if dati.get("azione") == "pianifica":
-        return esegui_piano(dati)
+        return esegui_piano(dati, progresso, sessione)
+
+    # Ogni azione chiude la consultazione paginata in sospeso: consulta_tabella la riapre
+    # se ci sono altre righe, così "altro" non riprende una query di qualche azione fa
+    pagine_in_sospeso.elimina(sessione)
 
     azione = dati.get("azione", "")
     nome_file = dati.get("file", "")
@@ -116,6 +589,10 @@ def esegui_azione(risposta_agente):
     condizione = dati.get("condizione", None)
     dati_db = dati.get("dati", {})
 
+    if azione in FASI_AZIONI:
+        fase, messaggio = FASI_AZIONI[azione]
+        _notifica(progresso, fase, messaggio, azione=azione)
+
     try:
         # Gestione opzioni multiple proposte dall'agente
         if azione == "scegli_opzione":
@@ -140,7 +617,7 @@ def esegui_azione(risposta_agente):
             output.append("")
             output.append("Rispondi con: scegli <numero> o solo il numero per procedere.")
 
-            response_cache["opzioni_correnti"] = opzioni
+            stato_sessione["opzioni_correnti"] = opzioni
             return "\n".join(output)
 
 
@@ -189,19 +666,61 @@ def esegui_azione(risposta_agente):
             risultato = gestione_db.elimina_tabella(nome_tabella)
             return risposta_testuale if risultato["success"] else f"Errore: {risultato['error']}"
         elif azione == "consulta_tabella":
-            risultato = gestione_db.consulta_tabella(nome_tabella, colonne, condizione)
+            # Solo la pagina richiesta viene letta dal database: le successive si chiedono con "altro"
+            pagina = dati.get("pagina")
+            risultato = gestione_db.consulta_pagina(
+                nome_tabella, colonne, condizione,
+                limite=dati.get("limite", gestione_db.DIMENSIONE_PAGINA),
+                token=pagina
+            )
             if not risultato["success"]:
                 return f"Errore: {risultato['error']}"
-            dati = risultato["data"]
-            if not dati:
-                return "Nessun risultato trovato."
-            colonne = list(dati[0].keys())
-            output = [risposta_testuale] if risposta_testuale else []
+            righe = risultato["data"]
+            if not righe:
+                return "Nessun altro risultato." if pagina else "Nessun risultato trovato."
+            colonne = list(righe[0].keys())
+            output = [risposta_testuale] if risposta_testuale and not pagina else []
             header = " - ".join(colonne)
             output.append(header)
-            for riga in dati:
+            for riga in righe:
                 row_data = " - ".join(str(riga.get(col, "")) for col in colonne)
                 output.append(row_data)
+            if risultato["pagina_successiva"]:
+                pagine_in_sospeso.set(sessione, {
+                    "azione": "consulta_tabella",
+                    "nome_tabella": nome_tabella,
+                    "colonne": dati.get("colonne", "*"),
+                    "condizione": condizione,
+                    "limite": dati.get("limite", gestione_db.DIMENSIONE_PAGINA),
+                    "pagina": risultato["pagina_successiva"]
+                }, dimensione=1)
+                output.append("")
+                output.append("Ci sono altre righe: scrivi 'altro' per vedere la pagina successiva.")
+            elif risultato.get("troncato"):
+                output.append("")
+                output.append(f"Sono mostrate solo le prime {len(righe)} righe: restringi la condizione per vedere le altre.")
+            return "\n".join(output)
+
+        elif azione == "aggrega_tabella":
+            risultato = gestione_db.aggrega_tabella(
+                nome_tabella,
+                gruppi=dati.get("gruppi"),
+                aggregazioni=dati.get("aggregazioni"),
+                condizione=condizione,
+                having=dati.get("having"),
+                ordina=dati.get("ordina"),
+                limite=dati.get("limite")
+            )
+            if not risultato["success"]:
+                return f"Errore: {risultato['error']}"
+            righe = risultato["data"]
+            if not righe:
+                return "Nessun risultato trovato."
+            colonne = list(righe[0].keys())
+            output = [risposta_testuale] if risposta_testuale else []
+            output.append(" - ".join(colonne))
+            for riga in righe:
+                output.append(" - ".join(str(riga.get(col, "")) for col in colonne))
             return "\n".join(output)
 
         elif azione == "elenca_tabelle":
@@ -220,12 +739,94 @@ def esegui_azione(risposta_agente):
                 return f"{testo}\n" + "\n".join(righe)
             return f"Errore: {risultato['error']}"
 
+        elif azione == "suggerisci_indici":
+            risultato = gestione_db.suggerisci_indici()
+            if not risultato["success"]:
+                return f"Errore: {risultato['error']}"
+            suggerimenti = risultato["data"]
+            if nome_tabella:
+                suggerimenti = [s for s in suggerimenti if s["tabella"].lower() == nome_tabella.lower()]
+            if not suggerimenti:
+                return "Nessun indice da consigliare: le query osservate non scandiscono intere tabelle."
+            output = [risposta_testuale or "Indici consigliati in base alle query eseguite:"]
+            for s in suggerimenti:
+                output.append(
+                    f"{s['sql']}  -- {s['esecuzioni']} query, {s['ms_medi']} ms in media "
+                    f"(es. WHERE {s['esempio']})"
+                )
+            return "\n".join(output)
+
+        elif azione == "crea_indice":
+            if not dati.get("colonne"):
+                return "Errore: colonne non specificate per la creazione dell'indice."
+            risultato = gestione_db.crea_indice(
+                nome_tabella, colonne,
+                nome_indice=dati.get("nome_indice") or None,
+                unico=bool(dati.get("unico", False)),
+                condizione=condizione
+            )
+            if not risultato["success"]:
+                return f"Errore durante la creazione dell'indice: {risultato['error']}"
+            return f"{risposta_testuale}\n{risultato['message']}" if risposta_testuale else risultato["message"]
+
+        elif azione == "elenca_indici":
+            risultato = gestione_db.elenca_indici(nome_tabella or None)
+            if not risultato["success"]:
+                return f"Errore: {risultato['error']}"
+            if not risultato["data"]:
+                return "Nessun indice presente."
+            output = [risposta_testuale or "Ecco gli indici presenti:"]
+            for indice in risultato["data"]:
+                dettagli = []
+                if indice["unico"]:
+                    dettagli.append("unico")
+                if indice["parziale"]:
+                    dettagli.append("parziale")
+                if indice["origine"] != "c":
+                    dettagli.append("automatico")
+                extra = f" [{', '.join(dettagli)}]" if dettagli else ""
+                output.append(f"{indice['tabella']}.{indice['nome']} ({', '.join(indice['colonne'])}){extra}")
+            return "\n".join(output)
+
+        elif azione == "elimina_indice":
+            nome_indice = dati.get("nome_indice", "")
+            if not nome_indice:
+                return "Errore: nome_indice non specificato."
+            risultato = gestione_db.elimina_indice(nome_indice)
+            if not risultato["success"]:
+                return f"Errore durante l'eliminazione dell'indice: {risultato['error']}"
+            return risposta_testuale or risultato["message"]
+
         elif azione == "esporta_tabella":
             file_destinazione = dati.get("file_destinazione", "")
             formato = dati.get("formato", "csv")
-            risultato = gestione_db.esporta_tabella(nome_tabella, file_destinazione, formato)
+            risultato = gestione_db.esporta_tabella(
+                nome_tabella, file_destinazione, formato,
+                modalita_txt=dati.get("modalita_txt", "due_passaggi")
+            )
             return risultato["message"] if risultato["success"] else f"Errore durante l'esportazione: {risultato['error']}"
 
+        elif azione == "esporta_database":
+            cartella = dati.get("cartella_destinazione", "") or percorso_destinazione or nome_file
+            if not cartella:
+                return "Errore: cartella_destinazione non specificata per l'esportazione del database."
+            risultato = gestione_db.esporta_database(
+                cartella,
+                tabelle=dati.get("tabelle") or None,
+                formato=dati.get("formato", "csv"),
+                modalita=dati.get("modalita", "thread")
+            )
+            return risultato["message"] if risultato["success"] else f"Errore durante l'esportazione: {risultato['error']}"
+
+        elif azione == "importa_tabella":
+            file_origine = dati.get("file_origine", "") or nome_file
+            if not file_origine:
+                return "Errore: file_origine non specificato per l'importazione."
+            risultato = gestione_db.importa_tabella(nome_tabella, file_origine, dati.get("formato"))
+            if not risultato["success"]:
+                return f"Errore durante l'importazione: {risultato['error']}"
+            return risposta_testuale or risultato["message"]
+
         elif azione == "modifica_tabella":
             operazione = dati.get("operazione", "")
             if operazione == "aggiungi_colonna":
@@ -246,14 +847,47 @@ def esegui_azione(risposta_agente):
 
 
 
-def esegui_piano(piano_json):
+def esegui_piano(piano_json, progresso=None, sessione=None):
     """
     Esegue un piano complesso (Hybrid Planner).
     Ogni step viene passato a esegui_azione.
     """
     risultati = []
-    for step in piano_json.get("steps", []):
-        risultati.append(esegui_azione(step))
+    steps = piano_json.get("steps", [])
+    for i, step in enumerate(steps, start=1):
+        _notifica(progresso, "piano", f"Passo {i} di {len(steps)}: {step.get('azione', '')}",
+                  passo=i, totale=len(steps))
+        risultati.append(esegui_azione(step, progresso, sessione))
     return "\n".join(risultati)
 
 
+async def esegui_azione_async(risposta_agente, progresso=None, sessione=None):
+    """
+    Versione asincrona di esegui_azione.
+    Le operazioni su SQLite e sui file sono bloccanti, quindi girano sull'executor;
+    i piani vengono eseguiti un passo alla volta senza occupare l'event loop.
+    """
+    if isinstance(risposta_agente, str):
+        try:
+            dati = json.loads(risposta_agente)
+        except json.JSONDecodeError:
+            return risposta_agente
+    else:
+        dati = risposta_agente
+
+    if isinstance(dati, dict) and dati.get("azione") == "pianifica":
+        return await esegui_piano_async(dati, progresso, sessione)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(esegui_azione, dati, progresso, sessione))
+
+
+async def esegui_piano_async(piano_json, progresso=None, sessione=None):
+    """Versione asincrona di esegui_piano"""
+    risultati = []
+    steps = piano_json.get("steps", [])
+    for i, step in enumerate(steps, start=1):
+        _notifica(progresso, "piano", f"Passo {i} di {len(steps)}: {step.get('azione', '')}",
+                  passo=i, totale=len(steps))
+        risultati.append(await esegui_azione_async(step, progresso, sessione))
+    return "\n".join(risultati)
@@ -1,6 +1,13 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from datetime import datetime
-from agent_core import chiedi_all_agente, esegui_azione
+import json
+import queue
+import atexit
+import threading
+from agent_core import chiedi_all_agente, chiedi_all_agente_stream, esegui_azione, response_cache, cache_persistente, richieste_in_volo, circuito_llm
+import gestione_http
+import gestione_db
+import gestione_intenti
 import whisper
 import os
 from werkzeug.utils import secure_filename
@@ -20,6 +27,15 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Modello Whisper (scegli "small" o "base")
 model = whisper.load_model("small")
 
+# --- Ciclo di vita delle connessioni al database ---
+# Ogni richiesta prende in prestito una connessione dal pool e la restituisce qui,
+# così la richiesta successiva (su un altro thread) la riusa già aperta e configurata
+@app.teardown_appcontext
+def fine_richiesta_db(eccezione=None):
+    gestione_db.connessioni.restituisci()
+
+atexit.register(gestione_db.chiudi_connessioni)
+
 # --- Funzione per salvare log chat ---
 def salva_log(messaggio_utente, risposta_agente):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -34,12 +50,95 @@ def home():
 @app.route("/chat", methods=["POST"])
 def chat():
     messaggio = request.json.get("messaggio", "")
-    risposta_json = chiedi_all_agente(messaggio)
-    risposta_testuale = esegui_azione(risposta_json)
+    sessione = request.json.get("sessione")
+    risposta_json = chiedi_all_agente(messaggio, sessione=sessione)
+    risposta_testuale = esegui_azione(risposta_json, sessione=sessione)
 
     salva_log(messaggio, risposta_testuale)
     return jsonify({"risposta": risposta_testuale})
 
+# --- Funzione per formattare un evento Server-Sent Events ---
+def evento_sse(tipo, dati):
+    return f"event: {tipo}\ndata: {json.dumps(dati, ensure_ascii=False)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    messaggio = request.json.get("messaggio", "")
+    # Id della conversazione (uno per scheda): lega "altro" alla consultazione di questa scheda
+    sessione = request.json.get("sessione")
+
+    def genera():
+        yield evento_sse("stato", {"fase": "llm", "messaggio": "Chiedo all'agente..."})
+        risposta_json = ""
+        for tipo, valore in chiedi_all_agente_stream(messaggio, sessione=sessione):
+            if tipo == "testo":
+                yield evento_sse("testo", {"testo": valore})
+            else:
+                risposta_json = valore
+
+        # Il JSON è completo: l'azione gira in un thread separato così le fasi
+        # (passi del piano, query, esportazioni) arrivano al client in tempo reale
+        eventi = queue.Queue()
+
+        def esegui():
+            try:
+                risultato = esegui_azione(risposta_json, progresso=lambda stato: eventi.put(("stato", stato)),
+                                          sessione=sessione)
+            except Exception as e:
+                risultato = f"Errore durante l'esecuzione dell'azione: {e}"
+            eventi.put(("fine", risultato))
+
+        threading.Thread(target=esegui, daemon=True).start()
+        while True:
+            tipo, valore = eventi.get()
+            if tipo == "stato":
+                yield evento_sse("stato", valore)
+            else:
+                risposta_testuale = valore
+                break
+
+        salva_log(messaggio, risposta_testuale)
+        yield evento_sse("fine", {"risposta": risposta_testuale})
+
+    return Response(
+        stream_with_context(genera()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/tabella/<nome_tabella>/pagina", methods=["GET"])
+def pagina_tabella(nome_tabella):
+    risultato = gestione_db.consulta_pagina(
+        nome_tabella,
+        request.args.get("colonne", "*"),
+        request.args.get("condizione") or None,
+        limite=request.args.get("limite", gestione_db.DIMENSIONE_PAGINA, type=int),
+        token=request.args.get("token") or None
+    )
+    return jsonify(risultato), (200 if risultato["success"] else 400)
+
+@app.route("/statistiche", methods=["GET"])
+def statistiche():
+    return jsonify({
+        "http_pool": gestione_http.statistiche_pool(),
+        "cache_llm": response_cache.statistiche(),
+        "cache_llm_persistente": cache_persistente.statistiche() if cache_persistente else None,
+        "richieste_in_volo": richieste_in_volo.statistiche(),
+        "circuito_llm": circuito_llm.statistiche(),
+        "router_locale": gestione_intenti.router.statistiche(),
+        "db_connessioni": gestione_db.connessioni.statistiche(),
+        "db_indici": gestione_db.consulente_indici.statistiche(),
+        "db_cache_query": gestione_db.cache_query.statistiche()
+    })
+
+@app.route("/cache/compatta", methods=["POST"])
+def compatta_cache():
+    # Il VACUUM riscrive l'intero file: si lancia su richiesta, non a ogni avvio
+    if cache_persistente is None:
+        return jsonify({"error": "Cache persistente non attiva"}), 400
+    cache_persistente.compatta()
+    return jsonify(cache_persistente.statistiche())
+
 @app.route("/transcribe", methods=["POST"])
 def transcribe_audio():
     if "file" not in request.files:
@@ -0,0 +1,397 @@
+import sys
+import sqlite3
+import time
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalizza_messaggio(messaggio):
+    """Normalizza il messaggio utente (Unicode NFC e spazi compattati) per usarlo come chiave"""
+    return " ".join(unicodedata.normalize("NFC", messaggio).split())
+
+
+def chiave_cache(modello, system_prompt, temperature, messaggio):
+    """
+    Costruisce la chiave di cache di una richiesta all'LLM.
+    Include modello, hash del SYSTEM_PROMPT e temperatura, così un cambio di prompt
+    o di modello non restituisce risposte calcolate con la configurazione precedente.
+    """
+    hash_prompt = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    parti = [modello, hash_prompt, repr(float(temperature)), normalizza_messaggio(messaggio)]
+    return hashlib.sha256("\x1f".join(parti).encode("utf-8")).hexdigest()
+
+
+class CacheRisposte:
+    """
+    Cache LRU in memoria con scadenza (TTL) e limite su numero di voci e byte occupati.
+    Thread-safe: può essere usata dai thread di Flask in parallelo.
+    """
+
+    def __init__(self, max_voci=1000, max_byte=32 * 1024 * 1024, ttl=3600):
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        self.ttl = ttl
+        self._voci = OrderedDict()  # chiave -> (valore, scadenza, dimensione)
+        self._byte = 0
+        self._lock = threading.Lock()
+        self.hit = 0
+        self.miss = 0
+        self.evizioni = 0
+        self.scadute = 0
+
+    @staticmethod
+    def _dimensione(chiave, valore):
+        return sys.getsizeof(chiave) + sys.getsizeof(valore)
+
+    def get(self, chiave, default=None):
+        """Restituisce il valore associato alla chiave, o default se assente o scaduto"""
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None:
+                self.miss += 1
+                return default
+            valore, scadenza, _ = voce
+            if scadenza is not None and scadenza <= time.monotonic():
+                self._rimuovi(chiave)
+                self.scadute += 1
+                self.miss += 1
+                return default
+            self._voci.move_to_end(chiave)
+            self.hit += 1
+            return valore
+
+    def set(self, chiave, valore, ttl=None, dimensione=None):
+        """
+        Inserisce o aggiorna una voce, eliminando le meno usate oltre i limiti.
+        'dimensione' permette al chiamante di indicare i byte occupati da valori annidati,
+        che sys.getsizeof non conta.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if dimensione is None:
+            dimensione = self._dimensione(chiave, valore)
+        if dimensione > self.max_byte:
+            return
+        with self._lock:
+            if chiave in self._voci:
+                self._rimuovi(chiave)
+            scadenza = time.monotonic() + ttl if ttl else None
+            self._voci[chiave] = (valore, scadenza, dimensione)
+            self._byte += dimensione
+            while self._voci and (len(self._voci) > self.max_voci or self._byte > self.max_byte):
+                chiave_vecchia = next(iter(self._voci))
+                self._rimuovi(chiave_vecchia)
+                self.evizioni += 1
+
+    def elimina(self, chiave):
+        with self._lock:
+            if chiave in self._voci:
+                self._rimuovi(chiave)
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self._byte = 0
+
+    def _rimuovi(self, chiave):
+        _, _, dimensione = self._voci.pop(chiave)
+        self._byte -= dimensione
+
+    def __len__(self):
+        return len(self._voci)
+
+    def statistiche(self):
+        """Contatori di hit/miss/evizioni e occupazione corrente"""
+        with self._lock:
+            richieste = self.hit + self.miss
+            return {
+                "voci": len(self._voci),
+                "byte": self._byte,
+                "max_voci": self.max_voci,
+                "max_byte": self.max_byte,
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_rate": round(self.hit / richieste, 4) if richieste else 0.0,
+                "evizioni": self.evizioni,
+                "scadute": self.scadute
+            }
+
+
+class CachePersistente:
+    """
+    Livello di cache su disco (SQLite) per le risposte deterministiche dell'LLM.
+    Sopravvive ai riavvii; le voci più usate possono essere ricaricate in memoria all'avvio.
+    """
+
+    def __init__(self, percorso, max_voci=20000, max_byte=256 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.percorso = percorso
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._scritture = 0
+        self.hit = 0
+        self.miss = 0
+        self._conn = sqlite3.connect(percorso, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_llm (
+                chiave TEXT PRIMARY KEY,
+                valore TEXT NOT NULL,
+                creato REAL NOT NULL,
+                ultimo_accesso REAL NOT NULL,
+                accessi INTEGER NOT NULL DEFAULT 0,
+                dimensione INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_llm_accesso ON cache_llm(ultimo_accesso)")
+        self._conn.commit()
+
+    def get(self, chiave):
+        """Restituisce il valore salvato su disco, o None se assente o scaduto"""
+        adesso = time.time()
+        with self._lock:
+            riga = self._conn.execute(
+                "SELECT valore, creato FROM cache_llm WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if riga is None or (self.ttl and riga[1] + self.ttl <= adesso):
+                self.miss += 1
+                return None
+            self._conn.execute(
+                "UPDATE cache_llm SET ultimo_accesso = ?, accessi = accessi + 1 WHERE chiave = ?",
+                (adesso, chiave)
+            )
+            self._conn.commit()
+            self.hit += 1
+            return riga[0]
+
+    def set(self, chiave, valore):
+        adesso = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_llm (chiave, valore, creato, ultimo_accesso, accessi, dimensione) "
+                "VALUES (?, ?, ?, ?, 0, ?)",
+                (chiave, valore, adesso, adesso, len(valore.encode("utf-8")))
+            )
+            self._conn.commit()
+            self._scritture += 1
+            # I limiti vengono controllati ogni tanto, non a ogni scrittura
+            if self._scritture % 50 == 0:
+                self._applica_limiti()
+
+    def _applica_limiti(self):
+        """Elimina le voci scadute e quelle usate meno di recente oltre i limiti (lock già acquisito)"""
+        if self.ttl:
+            self._conn.execute("DELETE FROM cache_llm WHERE creato <= ?", (time.time() - self.ttl,))
+        voci, byte = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM cache_llm").fetchone()
+        if voci > self.max_voci:
+            self._conn.execute(
+                "DELETE FROM cache_llm WHERE chiave IN "
+                "(SELECT chiave FROM cache_llm ORDER BY ultimo_accesso LIMIT ?)",
+                (voci - self.max_voci,)
+            )
+        if byte > self.max_byte:
+            # Elimina le voci meno recenti finché la somma delle dimensioni rientra nel limite
+            da_liberare = byte - self.max_byte
+            chiavi = []
+            for chiave, dimensione in self._conn.execute(
+                    "SELECT chiave, dimensione FROM cache_llm ORDER BY ultimo_accesso"):
+                if da_liberare <= 0:
+                    break
+                chiavi.append((chiave,))
+                da_liberare -= dimensione
+            self._conn.executemany("DELETE FROM cache_llm WHERE chiave = ?", chiavi)
+        self._conn.commit()
+
+    def pulisci(self):
+        """Applica scadenza e limiti senza riscrivere il file: abbastanza economico da farlo all'avvio"""
+        with self._lock:
+            self._applica_limiti()
+
+    def compatta(self):
+        """Applica scadenza e limiti, poi recupera lo spazio su disco con VACUUM (costoso, solo su richiesta)"""
+        with self._lock:
+            self._applica_limiti()
+            self._conn.execute("VACUUM")
+
+    def voci_calde(self, limite=200):
+        """Restituisce le voci valide più usate, per precaricarle nella cache in memoria"""
+        with self._lock:
+            minimo = time.time() - self.ttl if self.ttl else 0
+            return self._conn.execute(
+                "SELECT chiave, valore FROM cache_llm WHERE creato > ? "
+                "ORDER BY accessi DESC, ultimo_accesso DESC LIMIT ?",
+                (minimo, limite)
+            ).fetchall()
+
+    def chiudi(self):
+        with self._lock:
+            self._conn.close()
+
+    def statistiche(self):
+        with self._lock:
+            voci, byte = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM cache_llm"
+            ).fetchone()
+            richieste = self.hit + self.miss
+            return {
+                "percorso": self.percorso,
+                "voci": voci,
+                "byte": byte,
+                "max_voci": self.max_voci,
+                "max_byte": self.max_byte,
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_rate": round(self.hit / richieste, 4) if richieste else 0.0
+            }
+
+
+class VoloInterrotto(Exception):
+    """Il chiamante che consumava un generatore condiviso si è interrotto prima della fine"""
+
+
+class _VoloStream:
+    """Elementi prodotti finora da un generatore condiviso, rigiocati a chi si aggiunge dopo"""
+
+    def __init__(self):
+        self.elementi = []
+        self.finito = False
+        self.errore = None
+        self.condizione = threading.Condition()
+
+
+class SingleFlight:
+    """
+    Coalescenza delle richieste identiche in corso: il primo chiamante esegue
+    la funzione, gli altri con la stessa chiave attendono lo stesso risultato.
+    Oltre alle funzioni normali coalizza generatori (esegui_stream) e coroutine (esegui_async).
+    """
+
+    def __init__(self):
+        self._in_volo = {}
+        self._in_volo_stream = {}
+        self._in_volo_async = {}  # (event loop, chiave) -> Task
+        self._lock = threading.Lock()
+        self.eseguite = 0
+        self.coalescenze = 0
+
+    def esegui(self, chiave, funzione):
+        with self._lock:
+            futuro = self._in_volo.get(chiave)
+            proprietario = futuro is None
+            if proprietario:
+                futuro = Future()
+                self._in_volo[chiave] = futuro
+                self.eseguite += 1
+            else:
+                self.coalescenze += 1
+
+        if not proprietario:
+            return futuro.result()
+
+        try:
+            risultato = funzione()
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(risultato)
+            return risultato
+        finally:
+            with self._lock:
+                self._in_volo.pop(chiave, None)
+
+    def esegui_stream(self, chiave, genera):
+        """
+        Come esegui, per un generatore: il primo chiamante consuma genera(), gli altri ricevono
+        gli stessi elementi, prima quelli già prodotti e poi i nuovi man mano che arrivano.
+        Se il primo chiamante si interrompe prima della fine, gli altri ricevono VoloInterrotto.
+        """
+        with self._lock:
+            volo = self._in_volo_stream.get(chiave)
+            proprietario = volo is None
+            if proprietario:
+                volo = _VoloStream()
+                self._in_volo_stream[chiave] = volo
+                self.eseguite += 1
+            else:
+                self.coalescenze += 1
+
+        if not proprietario:
+            yield from self._segui(volo)
+            return
+
+        errore = None
+        try:
+            for elemento in genera():
+                with volo.condizione:
+                    volo.elementi.append(elemento)
+                    volo.condizione.notify_all()
+                yield elemento
+        except Exception as e:
+            errore = e
+            raise
+        except BaseException:
+            # GeneratorExit (client disconnesso) o interruzione: gli altri non avranno la fine
+            errore = VoloInterrotto("La richiesta identica in corso è stata interrotta")
+            raise
+        finally:
+            with volo.condizione:
+                volo.finito = True
+                volo.errore = errore
+                volo.condizione.notify_all()
+            with self._lock:
+                self._in_volo_stream.pop(chiave, None)
+
+    @staticmethod
+    def _segui(volo):
+        """Rigioca gli elementi di un generatore condiviso, attendendo quelli non ancora prodotti"""
+        letti = 0
+        while True:
+            with volo.condizione:
+                while letti >= len(volo.elementi) and not volo.finito:
+                    volo.condizione.wait()
+                nuovi = volo.elementi[letti:]
+                finito = volo.finito
+            letti += len(nuovi)
+            yield from nuovi
+            if finito:
+                if volo.errore is not None:
+                    raise volo.errore
+                return
+
+    async def esegui_async(self, chiave, funzione):
+        """
+        Come esegui, per una coroutine: il primo chiamante la avvia come Task dell'event loop
+        corrente, gli altri attendono lo stesso Task. L'attesa è protetta con shield, così
+        la cancellazione di un chiamante non interrompe la richiesta per gli altri.
+        """
+        loop = asyncio.get_running_loop()
+        voce = (loop, chiave)
+        with self._lock:
+            task = self._in_volo_async.get(voce)
+            if task is None:
+                task = loop.create_task(funzione())
+                self._in_volo_async[voce] = task
+                task.add_done_callback(lambda fatto: self._fine_async(voce, fatto))
+                self.eseguite += 1
+            else:
+                self.coalescenze += 1
+        return await asyncio.shield(task)
+
+    def _fine_async(self, voce, task):
+        with self._lock:
+            if self._in_volo_async.get(voce) is task:
+                del self._in_volo_async[voce]
+
+    def statistiche(self):
+        with self._lock:
+            return {
+                "in_corso": len(self._in_volo) + len(self._in_volo_stream) + len(self._in_volo_async),
+                "eseguite": self.eseguite,
+                "coalescenze": self.coalescenze
+            }
@@ -1,6 +1,6 @@
 # gestione_chat.py
 import re
-from agent_core import chiedi_all_agente, esegui_azione, response_cache
+from agent_core import chiedi_all_agente, esegui_azione, stato_sessione
 import json
 
 def gestisci_input_utente(testo_utente):
@@ -8,8 +8,8 @@ def gestisci_input_utente(testo_utente):
     scelta = None
 
     # 1️⃣ Controlla se ci sono opzioni pendenti
-    if "opzioni_correnti" in response_cache:
-        opzioni = response_cache["opzioni_correnti"]
+    if "opzioni_correnti" in stato_sessione:
+        opzioni = stato_sessione["opzioni_correnti"]
 
         # Estrai il numero dall'input
         if testo_utente.lower().startswith("scegli "):
@@ -25,7 +25,7 @@ def gestisci_input_utente(testo_utente):
             if 1 <= scelta <= len(opzioni):
                 azione_scelta = opzioni[scelta - 1].get("azione_proposta")
                 # Rimuovi le opzioni solo dopo aver preso la scelta
-                response_cache.pop("opzioni_correnti", None)
+                stato_sessione.pop("opzioni_correnti", None)
                 if azione_scelta:
                     risultato = esegui_azione(azione_scelta)
                     # Se la funzione restituisce JSON, prendiamo solo risposta_testuale
@@ -51,7 +51,7 @@ def gestisci_input_utente(testo_utente):
             if dati.get("azione") == "scegli_opzione":
                 opzioni = dati.get("opzioni", [])
                 if opzioni:
-                    response_cache["opzioni_correnti"] = opzioni
+                    stato_sessione["opzioni_correnti"] = opzioni
                 # Restituisci sempre solo il campo risposta_testuale
                 return dati.get("risposta_testuale", "Ho trovato più possibilità, scegli un'opzione:")
             else:
@@ -2,44 +2,924 @@ import sqlite3
 import json
 import csv
 import os
+import re
+import sys
+import gzip
+import time
+import base64
+import weakref
+import itertools
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import threading
 from pathlib import Path
+from contextlib import contextmanager
+from collections.abc import Mapping, Sequence
+import gestione_cache
+
+try:
+    import pyarrow as pa  # opzionale, solo per l'esportazione in Parquet/Arrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
 DB_PATH = "database.sqlite"
 
+# Numero massimo di connessioni aperte contemporaneamente (in prestito o inattive)
+MAX_CONNESSIONI = int(os.getenv("SQLITE_MAX_CONNESSIONI", "16"))
+# Secondi di inattività dopo i quali una connessione viene verificata prima del riuso
+INTERVALLO_CONTROLLO = 30.0
+
+
+class _SlotConnessione:
+    """Connessione del pool; se il thread che la ha in prestito termina senza restituirla, viene chiusa e il posto liberato"""
+
+    def __init__(self, conn, percorso, libera_posto):
+        self.conn = conn
+        self.percorso = percorso
+        self.ultimo_uso = time.monotonic()
+        self._finalizzatore = weakref.finalize(self, _chiudi_slot, conn, libera_posto)
+
+    @property
+    def aperta(self):
+        return self._finalizzatore.alive
+
+    def chiudi(self):
+        self._finalizzatore()
+
+
+def _chiudi_slot(conn, libera_posto):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+    libera_posto()
+
+
+class GestoreConnessioni:
+    """
+    Pool limitato di connessioni SQLite persistenti, date in prestito ai thread.
+    Alla prima query un thread prende una connessione inattiva (o ne apre una nuova se c'è posto)
+    e la usa per tutte le query successive finché non la restituisce con restituisci(),
+    a fine richiesta HTTP o a fine azione: così i thread di breve durata del server
+    riusano le connessioni già aperte e configurate invece di crearne una a testa.
+    Le connessioni inattive da tempo vengono verificate prima del riuso.
+    """
+
+    def __init__(self, max_connessioni=MAX_CONNESSIONI, attesa=10.0):
+        self.max_connessioni = max_connessioni
+        self.attesa = attesa
+        self._locale = threading.local()
+        self._slot = weakref.WeakSet()
+        self._inattive = []  # pila: viene riusata per prima la connessione restituita più di recente
+        self._aperte = 0
+        # RLock: il finalizzatore di uno slot può essere chiamato mentre il lock è già acquisito
+        self._lock = threading.RLock()
+        self._disponibile = threading.Condition(self._lock)
+        self._alla_creazione = []
+        self.create = 0
+        self.riutilizzi = 0
+        self.scartate = 0
+
+    def alla_creazione(self, funzione):
+        """Registra una funzione chiamata su ogni nuova connessione (es. PRAGMA di configurazione)"""
+        self._alla_creazione.append(funzione)
+        return funzione
+
+    def connessione(self):
+        """Restituisce la connessione in prestito al thread corrente, prendendone una dal pool se necessario"""
+        slot = getattr(self._locale, "slot", None)
+        if slot is not None:
+            if slot.percorso == DB_PATH and self._sana(slot):
+                slot.ultimo_uso = time.monotonic()
+                return slot.conn
+            self.scartate += 1
+            self.rilascia()
+
+        slot = self._preleva()
+        slot.ultimo_uso = time.monotonic()
+        self._locale.slot = slot
+        return slot.conn
+
+    def _preleva(self):
+        """Prende una connessione inattiva e sana, ne apre una nuova se c'è posto, altrimenti attende"""
+        scadenza = time.monotonic() + self.attesa
+        with self._disponibile:
+            while True:
+                while self._inattive:
+                    slot = self._inattive.pop()
+                    if slot.percorso == DB_PATH and self._sana(slot):
+                        self.riutilizzi += 1
+                        return slot
+                    self.scartate += 1
+                    slot.chiudi()
+                if self._aperte < self.max_connessioni:
+                    self._aperte += 1
+                    break
+                residuo = scadenza - time.monotonic()
+                if residuo <= 0:
+                    raise sqlite3.OperationalError(
+                        f"Raggiunto il numero massimo di connessioni al database ({self.max_connessioni})"
+                    )
+                self._disponibile.wait(residuo)
+
+        try:
+            # check_same_thread=False perché la connessione passa da un thread all'altro tra un prestito
+            # e il successivo: finché è in prestito la usa solo il thread che l'ha presa
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            for funzione in self._alla_creazione:
+                funzione(conn)
+        except Exception:
+            self._libera_posto()
+            raise
+
+        slot = _SlotConnessione(conn, DB_PATH, self._libera_posto)
+        with self._lock:
+            self._slot.add(slot)
+            self.create += 1
+        return slot
+
+    def _libera_posto(self):
+        with self._disponibile:
+            self._aperte -= 1
+            self._disponibile.notify()
+
+    @staticmethod
+    def _sana(slot):
+        if time.monotonic() - slot.ultimo_uso < INTERVALLO_CONTROLLO:
+            return True
+        try:
+            slot.conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def restituisci(self):
+        """
+        Riporta nel pool la connessione in prestito al thread corrente (a fine richiesta o azione),
+        annullando eventuali transazioni rimaste aperte
+        """
+        slot = getattr(self._locale, "slot", None)
+        if slot is None:
+            return
+        self._locale.slot = None
+        if not slot.aperta:
+            return
+        try:
+            if slot.conn.in_transaction:
+                slot.conn.rollback()
+        except sqlite3.Error:
+            self.scartate += 1
+            slot.chiudi()
+            return
+        slot.ultimo_uso = time.monotonic()
+        with self._disponibile:
+            self._inattive.append(slot)
+            self._disponibile.notify()
+
+    def rilascia(self):
+        """Chiude la connessione in prestito al thread corrente invece di restituirla"""
+        slot = getattr(self._locale, "slot", None)
+        if slot is not None:
+            self._locale.slot = None
+            slot.chiudi()
+
+    def chiudi_tutte(self):
+        """Chiude tutte le connessioni aperte (da chiamare allo spegnimento)"""
+        with self._lock:
+            slot_aperti = list(self._slot)
+            self._slot.clear()
+            self._inattive.clear()
+        for slot in slot_aperti:
+            slot.chiudi()
+        self._locale = threading.local()
+
+    def slot_liberi(self):
+        """Connessioni utilizzabili subito senza attendere: inattive più quelle che si possono ancora aprire"""
+        with self._lock:
+            return max(self.max_connessioni - self._aperte, 0) + len(self._inattive)
+
+    def statistiche(self):
+        with self._lock:
+            aperte = self._aperte
+            inattive = len(self._inattive)
+        return {
+            "aperte": aperte,
+            "inattive": inattive,
+            "in_prestito": aperte - inattive,
+            "max_connessioni": self.max_connessioni,
+            "create": self.create,
+            "riutilizzi": self.riutilizzi,
+            "scartate": self.scartate
+        }
+
+
+connessioni = GestoreConnessioni()
+
+
+# Profili di prestazione applicati a ogni nuova connessione.
+# cache_size negativo = KiB; mmap_size in byte; busy_timeout in millisecondi.
+PROFILI_PRESTAZIONI = {
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -32000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000
+    }
+}
+
+PROFILO_PRESTAZIONI = os.getenv("SQLITE_PROFILO", "balanced")
+
+
+def _applica_pragma(conn, profilo, includi_journal=True):
+    for nome, valore in profilo.items():
+        if nome == "journal_mode" and not includi_journal:
+            continue
+        conn.execute(f"PRAGMA {nome}={valore}").fetchall()
+
+
+@connessioni.alla_creazione
+def _configura_connessione(conn):
+    profilo = PROFILI_PRESTAZIONI.get(PROFILO_PRESTAZIONI)
+    if profilo is None:
+        print(f"[DEBUG] Profilo SQLite '{PROFILO_PRESTAZIONI}' sconosciuto, uso 'balanced'")
+        profilo = PROFILI_PRESTAZIONI["balanced"]
+    _applica_pragma(conn, profilo)
+
+
+def imposta_profilo(nome_profilo):
+    """
+    Cambia il profilo predefinito per le nuove connessioni e lo applica
+    subito alla connessione del thread corrente.
+    """
+    global PROFILO_PRESTAZIONI
+    if nome_profilo not in PROFILI_PRESTAZIONI:
+        return {"success": False, "error": f"Profilo non valido: {nome_profilo}"}
+    PROFILO_PRESTAZIONI = nome_profilo
+    _applica_pragma(connessione(), PROFILI_PRESTAZIONI[nome_profilo])
+    return {"success": True, "message": f"Profilo SQLite impostato a '{nome_profilo}'"}
+
+
+@contextmanager
+def profilo_temporaneo(nome_profilo):
+    """
+    Applica un profilo alla connessione del thread corrente solo per la durata del blocco,
+    ad esempio "bulk-load" attorno a un caricamento massivo, poi ripristina i valori precedenti.
+    Il journal_mode non viene toccato perché vale per l'intero database.
+    """
+    profilo = PROFILI_PRESTAZIONI[nome_profilo]
+    conn = connessione()
+    precedenti = {
+        nome: conn.execute(f"PRAGMA {nome}").fetchone()[0]
+        for nome in profilo if nome != "journal_mode"
+    }
+    _applica_pragma(conn, profilo, includi_journal=False)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.commit()
+        _applica_pragma(conn, precedenti)
+
+
+def connessione():
+    """Connessione in prestito al thread corrente (vedi GestoreConnessioni)"""
+    return connessioni.connessione()
+
+
+def chiudi_connessioni():
+    """Hook di chiusura per CLI e server: chiude tutte le connessioni del pool"""
+    connessioni.chiudi_tutte()
+
+
+class CatalogoSchema:
+    """
+    Catalogo in memoria dello schema: tabelle, colonne, indici e stima delle righe.
+    Viene ricaricato quando le funzioni DDL lo invalidano o quando PRAGMA schema_version
+    cambia (modifiche fatte da altri processi), così le letture dello schema
+    non richiedono query su sqlite_master o PRAGMA table_info.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versione = None
+        self._tabelle = {}   # nome in minuscolo -> info tabella
+        self._valido = False
+        self.ricaricamenti = 0
+
+    def invalida(self):
+        """Segna il catalogo come da ricaricare alla prossima lettura"""
+        with self._lock:
+            self._valido = False
+
+    def _aggiorna(self):
+        """Ricarica il catalogo se invalidato o se lo schema è cambiato (lock già acquisito)"""
+        conn = connessione()
+        versione = conn.execute("PRAGMA schema_version").fetchone()[0]
+        if self._valido and versione == self._versione:
+            return
+        tabelle = {}
+        sql_indici = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type='index'").fetchall())
+        con_trigger = {r[0].lower() for r in conn.execute("SELECT tbl_name FROM sqlite_master WHERE type='trigger'")}
+        for nome, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall():
+            cursore = conn.execute(f'PRAGMA table_info("{nome}")')
+            nomi = [d[0] for d in cursore.description]
+            colonne = [dict(zip(nomi, riga)) for riga in cursore.fetchall()]
+            indici = []
+            for indice in conn.execute(f'PRAGMA index_list("{nome}")').fetchall():
+                nome_indice, unico, origine, parziale = indice[1], indice[2], indice[3], indice[4]
+                # Le colonne calcolate da un'espressione hanno nome None
+                colonne_indice = [r[2] for r in conn.execute(f'PRAGMA index_info("{nome_indice}")').fetchall()]
+                indici.append({
+                    "name": nome_indice,
+                    "unique": bool(unico),
+                    "origin": origine,
+                    "partial": bool(parziale),
+                    "columns": colonne_indice,
+                    "sql": sql_indici.get(nome_indice)
+                })
+            tabelle[nome.lower()] = {
+                "name": nome,
+                "columns": colonne,
+                "indexes": indici,
+                "row_estimate": self._stima_righe(conn, nome),
+                "without_rowid": "WITHOUT ROWID" in " ".join((sql or "").upper().split()),
+                "triggers": nome.lower() in con_trigger
+            }
+        self._tabelle = tabelle
+        self._versione = versione
+        self._valido = True
+        self.ricaricamenti += 1
+
+    @staticmethod
+    def _stima_righe(conn, nome):
+        """Stima veloce del numero di righe: sqlite_stat1 se presente, altrimenti MAX(rowid)"""
+        try:
+            riga = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND idx IS NULL", (nome,)
+            ).fetchone()
+            if riga:
+                return int(str(riga[0]).split()[0])
+        except sqlite3.Error:
+            pass
+        try:
+            riga = conn.execute(f'SELECT MAX(rowid) FROM "{nome}"').fetchone()
+            return riga[0] or 0
+        except sqlite3.Error:
+            # Tabelle WITHOUT ROWID
+            return None
+
+    def tabelle(self):
+        """Nomi delle tabelle presenti nel database"""
+        with self._lock:
+            self._aggiorna()
+            return [info["name"] for info in self._tabelle.values()]
+
+    def tabella(self, nome_tabella):
+        """Informazioni complete su una tabella, o None se non esiste"""
+        with self._lock:
+            self._aggiorna()
+            return self._tabelle.get(str(nome_tabella).lower())
+
+    def colonne(self, nome_tabella):
+        info = self.tabella(nome_tabella)
+        return info["columns"] if info else []
+
+    def indici(self, nome_tabella):
+        info = self.tabella(nome_tabella)
+        return info["indexes"] if info else []
+
+    def ha_trigger(self, nome_tabella):
+        """True se sulla tabella sono definiti trigger (una scrittura può modificare anche altre tabelle)"""
+        info = self.tabella(nome_tabella)
+        return bool(info and info["triggers"])
+
+    def righe_stimate(self, nome_tabella):
+        info = self.tabella(nome_tabella)
+        return info["row_estimate"] if info else None
+
+    def chiave_paginazione(self, nome_tabella):
+        """
+        Colonna usata per la paginazione keyset: rowid, oppure la chiave primaria
+        (a colonna singola) per le tabelle WITHOUT ROWID
+        """
+        info = self.tabella(nome_tabella)
+        if info is None or not info["without_rowid"]:
+            return "rowid"
+        pk = [col["name"] for col in info["columns"] if col["pk"]]
+        if len(pk) != 1:
+            raise ValueError(f"Paginazione non supportata per '{nome_tabella}': chiave primaria composta")
+        return f'"{pk[0]}"'
+
+
+catalogo = CatalogoSchema()
+
+
+# Il consulente degli indici osserva le condizioni WHERE eseguite; con SQLITE_INDICI_AUTOMATICI=1
+# crea da solo gli indici consigliati sulle tabelle con almeno RIGHE_MINIME_INDICE righe
+CONSULENTE_INDICI_ATTIVO = os.getenv("CONSULENTE_INDICI", "1") == "1"
+INDICI_AUTOMATICI = os.getenv("SQLITE_INDICI_AUTOMATICI", "0") == "1"
+SOGLIA_INDICI_AUTOMATICI = int(os.getenv("SOGLIA_INDICI_AUTOMATICI", "3"))
+RIGHE_MINIME_INDICE = int(os.getenv("RIGHE_MINIME_INDICE", "1000"))
+
+_LETTERALI_SQL = re.compile(r"'(?:[^']|'')*'")
+_IDENTIFICATORI_SQL = re.compile(r'"([^"]+)"|`([^`]+)`|\[([^\]]+)\]|\b([A-Za-z_][A-Za-z0-9_]*)\b')
+_OPERATORI_UGUAGLIANZA = re.compile(r"\s*(?:==?(?!=)|IS\b(?!\s+NOT\b)|IN\b)", re.IGNORECASE)
+
+
+class ConsulenteIndici:
+    """
+    Registra le colonne usate nelle condizioni WHERE e il tempo di ogni query.
+    Per ogni combinazione (tabella, colonne) controlla una volta con EXPLAIN QUERY PLAN
+    se SQLite scandisce l'intera tabella e in quel caso consiglia un CREATE INDEX:
+    prima le colonne confrontate per uguaglianza, poi la prima usata per un intervallo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._osservazioni = {}  # (tabella, colonne) -> statistiche
+        self.applicati = []
+
+    @staticmethod
+    def colonne_condizione(nome_tabella, condizione):
+        """Colonne della tabella citate nella condizione, nell'ordine consigliato per un indice"""
+        nomi = {col["name"].lower(): col["name"] for col in catalogo.colonne(nome_tabella)}
+        testo = _LETTERALI_SQL.sub("?", condizione)
+        uguaglianza, intervallo = [], []
+        for corrispondenza in _IDENTIFICATORI_SQL.finditer(testo):
+            nome = next(g for g in corrispondenza.groups() if g is not None)
+            colonna = nomi.get(nome.lower())
+            if colonna is None or colonna in uguaglianza or colonna in intervallo:
+                continue
+            if _OPERATORI_UGUAGLIANZA.match(testo, corrispondenza.end()):
+                uguaglianza.append(colonna)
+            else:
+                intervallo.append(colonna)
+        return tuple(uguaglianza + intervallo[:1])
+
+    @staticmethod
+    def _scansione(query, parametri):
+        """True se il piano di esecuzione contiene una SCAN della tabella senza indice"""
+        piano = connessione().execute(f"EXPLAIN QUERY PLAN {query}", parametri or []).fetchall()
+        for riga in piano:
+            dettaglio = str(riga[-1]).upper()
+            if dettaglio.startswith("SCAN") and "INDEX" not in dettaglio:
+                return True
+        return False
+
+    @staticmethod
+    def _indicizzata(nome_tabella, colonne):
+        """True se un indice esistente inizia già con le colonne consigliate"""
+        for indice in catalogo.indici(nome_tabella):
+            if [c.lower() if c else c for c in indice["columns"][:len(colonne)]] == [c.lower() for c in colonne]:
+                return True
+        return False
+
+    def osserva(self, nome_tabella, condizione, query, parametri, secondi):
+        """Registra una query eseguita; non solleva mai eccezioni verso il chiamante"""
+        if not CONSULENTE_INDICI_ATTIVO or not condizione:
+            return
+        try:
+            colonne = self.colonne_condizione(nome_tabella, condizione)
+            if not colonne:
+                return
+            info = catalogo.tabella(nome_tabella)
+            chiave = (info["name"], colonne)
+            generazione = catalogo.ricaricamenti
+            with self._lock:
+                voce = self._osservazioni.setdefault(chiave, {
+                    "esecuzioni": 0, "scansioni": 0, "secondi_totali": 0.0, "secondi_massimi": 0.0,
+                    "esempio": condizione, "scansione": None, "generazione": None
+                })
+                voce["esecuzioni"] += 1
+                voce["secondi_totali"] += secondi
+                voce["secondi_massimi"] = max(voce["secondi_massimi"], secondi)
+                # L'ultima query serve a ricontrollare il piano quando cambia lo schema
+                voce["query"] = query
+                voce["parametri"] = list(parametri or [])
+            self._ricontrolla(chiave, voce, generazione)
+            with self._lock:
+                if voce["scansione"]:
+                    voce["scansioni"] += 1
+                applica = (INDICI_AUTOMATICI and voce["scansione"]
+                           and voce["scansioni"] >= SOGLIA_INDICI_AUTOMATICI
+                           and (info["row_estimate"] or 0) >= RIGHE_MINIME_INDICE)
+            if applica:
+                self.applica(info["name"], colonne)
+        except (sqlite3.Error, KeyError, TypeError) as e:
+            print(f"[DEBUG] Consulente indici: osservazione ignorata ({e})")
+
+    def _ricontrolla(self, chiave, voce, generazione):
+        """Ripete EXPLAIN QUERY PLAN se lo schema è cambiato dall'ultima verifica della combinazione"""
+        with self._lock:
+            if voce["generazione"] == generazione:
+                return
+        nome_tabella, colonne = chiave
+        scansione = self._scansione(voce["query"], voce["parametri"]) and not self._indicizzata(nome_tabella, colonne)
+        with self._lock:
+            voce["scansione"] = scansione
+            voce["generazione"] = generazione
+
+    @staticmethod
+    def nome_indice(nome_tabella, colonne):
+        return re.sub(r"\W", "_", f"idx_auto_{nome_tabella}_{'_'.join(colonne)}")
+
+    def istruzione(self, nome_tabella, colonne):
+        elenco = ", ".join(f'"{c}"' for c in colonne)
+        return f'CREATE INDEX IF NOT EXISTS "{self.nome_indice(nome_tabella, colonne)}" ON "{nome_tabella}" ({elenco})'
+
+    def suggerimenti(self):
+        """Indici consigliati, dal più costoso in tempo di query al meno costoso"""
+        # Un indice creato dopo l'osservazione (anche fuori dal consulente) rende superfluo il consiglio
+        catalogo.tabelle()
+        generazione = catalogo.ricaricamenti
+        with self._lock:
+            osservate = list(self._osservazioni.items())
+        for chiave, voce in osservate:
+            try:
+                if catalogo.tabella(chiave[0]) is None:
+                    raise sqlite3.OperationalError(f"no such table: {chiave[0]}")
+                if voce["scansione"]:
+                    self._ricontrolla(chiave, voce, generazione)
+            except sqlite3.Error:
+                # La tabella o le colonne non esistono più
+                with self._lock:
+                    self._osservazioni.pop(chiave, None)
+        with self._lock:
+            voci = [(chiave, dict(voce)) for chiave, voce in self._osservazioni.items() if voce["scansione"]]
+        risultato = []
+        for (nome_tabella, colonne), voce in voci:
+            risultato.append({
+                "tabella": nome_tabella,
+                "colonne": list(colonne),
+                "esecuzioni": voce["esecuzioni"],
+                "scansioni": voce["scansioni"],
+                "secondi_totali": round(voce["secondi_totali"], 4),
+                "ms_medi": round(voce["secondi_totali"] / voce["esecuzioni"] * 1000, 3),
+                "righe_stimate": catalogo.righe_stimate(nome_tabella),
+                "esempio": voce["esempio"],
+                "sql": self.istruzione(nome_tabella, colonne)
+            })
+        risultato.sort(key=lambda s: s["secondi_totali"], reverse=True)
+        return risultato
+
+    def applica(self, nome_tabella, colonne):
+        """Crea l'indice consigliato per (tabella, colonne) con crea_indice"""
+        risultato = crea_indice(nome_tabella, list(colonne), nome_indice=self.nome_indice(nome_tabella, colonne),
+                                se_non_esiste=True)
+        if risultato["success"]:
+            with self._lock:
+                self._osservazioni.pop((nome_tabella, tuple(colonne)), None)
+                self.applicati.append({"sql": risultato["sql"], "secondi": risultato["secondi"]})
+            print(f"[DEBUG] Indice creato automaticamente in {risultato['secondi']}s: {risultato['sql']}")
+        return risultato
+
+    def azzera(self):
+        with self._lock:
+            self._osservazioni.clear()
+
+    def statistiche(self):
+        with self._lock:
+            osservate = len(self._osservazioni)
+            applicati = list(self.applicati)
+        return {
+            "attivo": CONSULENTE_INDICI_ATTIVO,
+            "automatico": INDICI_AUTOMATICI,
+            "combinazioni_osservate": osservate,
+            "suggerimenti": self.suggerimenti(),
+            "applicati": applicati
+        }
+
+
+consulente_indici = ConsulenteIndici()
+
+
+def suggerisci_indici():
+    """Restituisce gli indici consigliati dal consulente in base alle query osservate"""
+    try:
+        return {"success": True, "data": consulente_indici.suggerimenti()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# Cache dei risultati delle SELECT, invalidata per tabella (CACHE_QUERY=0 per disattivarla)
+CACHE_QUERY_ATTIVA = os.getenv("CACHE_QUERY", "1") == "1"
+CACHE_QUERY_MAX_VOCI = int(os.getenv("CACHE_QUERY_MAX_VOCI", "500"))
+CACHE_QUERY_MAX_BYTE = int(os.getenv("CACHE_QUERY_MAX_BYTE", str(64 * 1024 * 1024)))
+
+_LETTERALI_E_IDENTIFICATORI = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_FUNZIONI_NON_DETERMINISTICHE = re.compile(
+    r"\b(?:random|randomblob|changes|total_changes|last_insert_rowid|current_date|current_time|current_timestamp)\b"
+    r"|'now'",
+    re.IGNORECASE
+)
+
+
+class CacheQuery:
+    """
+    Cache dei risultati delle SELECT con chiave SQL normalizzato + parametri.
+    Ogni voce ricorda la versione delle tabelle lette al momento della query: le scritture
+    fatte da questo modulo incrementano la versione delle tabelle coinvolte, così solo le voci
+    che le leggono diventano obsolete. Le scritture di altri processi vengono rilevate con
+    PRAGMA data_version su una connessione sentinella e invalidano l'intera cache.
+    L'LRU e il limite di memoria sono quelli di gestione_cache.CacheRisposte.
+    """
+
+    def __init__(self, max_voci=CACHE_QUERY_MAX_VOCI, max_byte=CACHE_QUERY_MAX_BYTE):
+        self._cache = gestione_cache.CacheRisposte(max_voci=max_voci, max_byte=max_byte, ttl=0)
+        self._lock = threading.Lock()
+        self._versioni = {}  # tabella in minuscolo -> versione
+        self._epoca = 0      # incrementata quando non si sa quali tabelle sono cambiate
+        self._sentinella = None
+        self._percorso_sentinella = None
+        self._data_version = None
+        self.hit = 0
+        self.miss = 0
+        self.obsolete = 0
+        self.non_memorizzabili = 0
+        self.scritture_esterne = 0
+
+    @staticmethod
+    def normalizza(query):
+        """Compatta gli spazi fuori da stringhe e identificatori tra virgolette"""
+        parti = _LETTERALI_E_IDENTIFICATORI.split(query)
+        return "".join(parte if i % 2 else " ".join(parte.split()) for i, parte in enumerate(parti))
+
+    @staticmethod
+    def tabelle_citate(query):
+        """Tabelle del catalogo nominate nella query (minuscolo)"""
+        nomi = {nome.lower() for nome in catalogo.tabelle()}
+        testo = _LETTERALI_SQL.sub("?", query)
+        citate = set()
+        for corrispondenza in _IDENTIFICATORI_SQL.finditer(testo):
+            nome = next(g for g in corrispondenza.groups() if g is not None).lower()
+            if nome in nomi:
+                citate.add(nome)
+        return citate
+
+    def _tabelle_lette(self, query):
+        """Tabelle lette da una SELECT memorizzabile, o None se il risultato non va messo in cache"""
+        if not query.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        if _FUNZIONI_NON_DETERMINISTICHE.search(query):
+            return None
+        return self.tabelle_citate(query) or None
+
+    def _controlla_versione_dati(self):
+        """Invalida tutto se un'altra connessione ha scritto nel database (lock già acquisito)"""
+        if self._sentinella is None or self._percorso_sentinella != DB_PATH:
+            if self._sentinella is not None:
+                self._sentinella.close()
+            self._sentinella = sqlite3.connect(DB_PATH, check_same_thread=False)
+            self._percorso_sentinella = DB_PATH
+            self._data_version = None
+            self._epoca += 1
+        versione = self._sentinella.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_version is not None and versione != self._data_version:
+            self._epoca += 1
+            self.scritture_esterne += 1
+        self._data_version = versione
+
+    def leggi(self, query, parametri, esegui):
+        """
+        Restituisce il risultato di 'esegui()' (colonne, righe) dalla cache se ancora valido,
+        altrimenti esegue la query e lo memorizza.
+        :return: (risultato, da_cache) con da_cache True se la query non è stata eseguita
+        """
+        if not CACHE_QUERY_ATTIVA:
+            return esegui(), False
+        tabelle = self._tabelle_lette(query)
+        if tabelle is None:
+            with self._lock:
+                self.non_memorizzabili += 1
+            return esegui(), False
+
+        chiave = (self.normalizza(query), repr(tuple(parametri or ())))
+        with self._lock:
+            self._controlla_versione_dati()
+        voce = self._cache.get(chiave)
+        with self._lock:
+            if voce is not None:
+                versioni, epoca, valore = voce
+                if epoca == self._epoca and all(self._versioni.get(t, 0) == v for t, v in versioni.items()):
+                    self.hit += 1
+                    return valore, True
+                self.obsolete += 1
+            self.miss += 1
+            # Le versioni vanno lette prima della query: una scrittura concorrente rende obsoleta la voce
+            versioni = {t: self._versioni.get(t, 0) for t in tabelle}
+            epoca = self._epoca
+        if voce is not None:
+            self._cache.elimina(chiave)
+
+        valore = esegui()
+        self._cache.set(chiave, (versioni, epoca, valore), dimensione=self._stima_dimensione(valore))
+        return valore, False
+
+    @staticmethod
+    def _stima_dimensione(valore):
+        """Byte occupati da (colonne, righe), stimati su un campione di righe"""
+        colonne, righe = valore
+        dimensione = sys.getsizeof(colonne) + sys.getsizeof(righe)
+        if righe:
+            campione = righe[:20]
+            per_riga = sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r) for r in campione) / len(campione)
+            dimensione += int(per_riga * len(righe))
+        return dimensione
+
+    def registra_scrittura(self, query=None, tabelle=None):
+        """
+        Incrementa la versione delle tabelle modificate (indicate o ricavate dalla query);
+        dopo un DDL, se non si riesce a capire quali sono o se una di esse ha trigger
+        (che possono scrivere in tabelle non nominate), invalida l'intera cache.
+        """
+        try:
+            if tabelle is None:
+                # Dopo un DDL (es. RENAME o DROP) i nomi nel catalogo non sono più affidabili
+                ddl = query and query.lstrip().upper().startswith(("CREATE", "DROP", "ALTER"))
+                tabelle = self.tabelle_citate(query) if query and not ddl else set()
+            if any(catalogo.ha_trigger(tabella) for tabella in tabelle):
+                tabelle = set()
+        except sqlite3.Error:
+            tabelle = set()
+        with self._lock:
+            if tabelle:
+                for tabella in tabelle:
+                    chiave = str(tabella).lower()
+                    self._versioni[chiave] = self._versioni.get(chiave, 0) + 1
+            else:
+                self._epoca += 1
+            # La scrittura appena fatta cambia data_version: non va scambiata per una esterna
+            if self._sentinella is not None and self._percorso_sentinella == DB_PATH:
+                self._data_version = self._sentinella.execute("PRAGMA data_version").fetchone()[0]
+
+    def svuota(self):
+        with self._lock:
+            self._epoca += 1
+        self._cache.svuota()
+
+    def statistiche(self):
+        lru = self._cache.statistiche()
+        with self._lock:
+            richieste = self.hit + self.miss
+            return {
+                "attiva": CACHE_QUERY_ATTIVA,
+                "voci": lru["voci"],
+                "byte": lru["byte"],
+                "max_voci": lru["max_voci"],
+                "max_byte": lru["max_byte"],
+                "evizioni": lru["evizioni"],
+                "hit": self.hit,
+                "miss": self.miss,
+                "hit_rate": round(self.hit / richieste, 4) if richieste else 0.0,
+                "obsolete": self.obsolete,
+                "non_memorizzabili": self.non_memorizzabili,
+                "scritture_esterne": self.scritture_esterne,
+                "tabelle_versionate": len(self._versioni)
+            }
+
+
+cache_query = CacheQuery()
+
+
 def inizializza_db():
     """Crea il database se non esiste"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.close()
+    connessione()
+    connessioni.restituisci()
     return f"Database inizializzato in {DB_PATH}"
 
 
-def esegui_query(query, parametri=None):
-    """Esegue una query SQL e restituisce i risultati"""
+class RigaVista(Mapping):
+    """
+    Vista in sola lettura di una riga di RisultatoColonnare, usabile come un dizionario
+    (riga["nome"], riga.get(...), riga.keys()) senza creare un dict per ogni riga.
+    """
+    __slots__ = ("_indici", "_valori")
+
+    def __init__(self, indici, valori):
+        self._indici = indici
+        self._valori = valori
+
+    def __getitem__(self, colonna):
+        return self._valori[self._indici[colonna]]
+
+    def __iter__(self):
+        return iter(self._indici)
+
+    def __len__(self):
+        return len(self._indici)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class RisultatoColonnare(Sequence):
+    """
+    Risultato di una query in formato compatto: una sola lista di nomi di colonna
+    condivisa e le righe come tuple (così come arrivano da sqlite3).
+    Iterando si ottengono viste RigaVista compatibili con il vecchio formato a dizionari.
+    """
+    __slots__ = ("colonne", "righe", "_indici")
+
+    def __init__(self, colonne, righe):
+        self.colonne = list(colonne)
+        self.righe = righe
+        self._indici = {nome: i for i, nome in enumerate(self.colonne)}
+
+    def __len__(self):
+        return len(self.righe)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [RigaVista(self._indici, riga) for riga in self.righe[indice]]
+        return RigaVista(self._indici, self.righe[indice])
+
+    def __iter__(self):
+        indici = self._indici
+        for riga in self.righe:
+            yield RigaVista(indici, riga)
+
+    def colonna(self, nome):
+        """Tutti i valori di una colonna, come lista"""
+        i = self._indici[nome]
+        return [riga[i] for riga in self.righe]
+
+    def per_colonna(self):
+        """Dizionario colonna -> lista di valori (formato a colonne)"""
+        if not self.righe:
+            return {nome: [] for nome in self.colonne}
+        return {nome: list(valori) for nome, valori in zip(self.colonne, zip(*self.righe))}
+
+    def in_dizionari(self):
+        """Conversione esplicita nel formato classico lista di dizionari"""
+        return [dict(zip(self.colonne, riga)) for riga in self.righe]
+
+
+def _esegui_lettura(conn, query, parametri):
+    cursor = conn.execute(query, parametri or [])
+    columns = [description[0] for description in cursor.description]
+    return columns, cursor.fetchall()
+
+
+def esegui_query(query, parametri=None, formato="dizionari", cache=False):
+    """
+    Esegue una query SQL e restituisce i risultati
+    :param formato: 'dizionari' (lista di dict, default) o 'colonnare' (RisultatoColonnare)
+    :param cache: True per servire le SELECT dalla cache dei risultati (vedi CacheQuery);
+                  'da_cache' nel risultato indica se la query non è stata eseguita
+    """
+    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        if parametri:
-            cursor.execute(query, parametri)
-        else:
-            cursor.execute(query)
-            
+        conn = connessione()
+
         if query.strip().upper().startswith(('SELECT', 'PRAGMA')):
             # Per query di selezione, restituisce i risultati
-            columns = [description[0] for description in cursor.description]
-            results = cursor.fetchall()
+            da_cache = False
+            if cache:
+                (columns, results), da_cache = cache_query.leggi(
+                    query, parametri, lambda: _esegui_lettura(conn, query, parametri)
+                )
+            else:
+                columns, results = _esegui_lettura(conn, query, parametri)
+            if formato == "colonnare":
+                return {"success": True, "data": RisultatoColonnare(columns, results), "da_cache": da_cache}
             # Converte i risultati in lista di dizionari
             results_list = [dict(zip(columns, row)) for row in results]
-            conn.close()
-            return {"success": True, "data": results_list}
+            return {"success": True, "data": results_list, "da_cache": da_cache}
         else:
             # Per query di modifica, fa il commit e restituisce il numero di righe modificate
+            cursor = conn.cursor()
+            if parametri:
+                cursor.execute(query, parametri)
+            else:
+                cursor.execute(query)
             conn.commit()
+            cache_query.registra_scrittura(query)
             affected_rows = cursor.rowcount
-            conn.close()
             return {"success": True, "affected_rows": affected_rows}
             
     except sqlite3.Error as e:
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
         return {"success": False, "error": str(e)}
 
 def crea_tabella(nome_tabella, definizione_colonne):
@@ -51,10 +931,158 @@ def crea_tabella(nome_tabella, definizione_colonne):
     """
     try:
         query = f"CREATE TABLE IF NOT EXISTS {nome_tabella} ({', '.join(definizione_colonne)})"
-        return esegui_query(query)
+        risultato = esegui_query(query)
+        catalogo.invalida()
+        return risultato
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# Righe per transazione nei caricamenti massivi
+DIMENSIONE_BLOCCO_CARICAMENTO = int(os.getenv("DIMENSIONE_BLOCCO_CARICAMENTO", "10000"))
+
+
+def _blocchi(righe, dimensione):
+    """Divide un iterabile qualsiasi in liste di al massimo 'dimensione' elementi"""
+    iteratore = iter(righe)
+    while True:
+        blocco = list(itertools.islice(iteratore, dimensione))
+        if not blocco:
+            return
+        yield blocco
+
+
+def _indici_utente(conn, nome_tabella):
+    """
+    Indici non unici creati con CREATE INDEX, che si possono eliminare e ricreare senza rischi.
+    Gli indici UNIQUE e quelli di PK/UNIQUE restano: senza di loro i duplicati verrebbero confermati.
+    """
+    sql_indici = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name = ? COLLATE NOCASE AND sql IS NOT NULL",
+        (nome_tabella,)
+    ).fetchall())
+    return [
+        (indice[1], sql_indici[indice[1]])
+        for indice in conn.execute(f'PRAGMA index_list("{nome_tabella}")').fetchall()
+        if not indice[2] and indice[3] == "c" and indice[1] in sql_indici
+    ]
+
+
+def _query_inserimento(nome_tabella, colonne):
+    placeholders = ','.join(['?' for _ in colonne])
+    nomi = ','.join(f'"{col}"' for col in colonne)
+    return f"INSERT INTO {nome_tabella} ({nomi}) VALUES ({placeholders})"
+
+
+def _raggruppa_per_colonne(blocco, colonne=None):
+    """
+    Raggruppa i record per insieme di colonne, così ogni gruppo diventa un solo executemany.
+    Con 'colonne' esplicite tutti i record formano un unico gruppo (le chiavi mancanti valgono NULL).
+    Restituisce coppie (colonne, lista di tuple di valori) nell'ordine di prima comparsa.
+    """
+    if colonne is not None:
+        firma = tuple(colonne)
+        if blocco and isinstance(blocco[0], Mapping):
+            return [(firma, [tuple(item.get(col) for col in firma) for item in blocco])]
+        return [(firma, [tuple(item) for item in blocco])]
+
+    gruppi = {}
+    firme = {}  # ordine delle chiavi del record -> firma canonica (stesso insieme, qualsiasi ordine)
+    for item in blocco:
+        chiavi = tuple(item)
+        firma = firme.get(chiavi)
+        if firma is None:
+            firma = firme[chiavi] = tuple(sorted(chiavi))
+        valori = gruppi.get(firma)
+        if valori is None:
+            valori = gruppi[firma] = []
+        valori.append(tuple(item[col] for col in firma))
+    return list(gruppi.items())
+
+
+def carica_in_blocco(nome_tabella, righe, dimensione_blocco=DIMENSIONE_BLOCCO_CARICAMENTO,
+                     colonne=None, ricostruisci_indici=False, profilo="bulk-load"):
+    """
+    Caricamento massivo da un iterabile o generatore di record, senza materializzarlo.
+    Ogni blocco di 'dimensione_blocco' righe è inserito in una transazione esplicita
+    (dimensione_blocco=None: un'unica transazione per tutto il caricamento).
+    :param righe: Iterabile di dizionari, oppure di tuple se 'colonne' è indicato
+    :param colonne: Colonne di destinazione; se None i record vengono raggruppati per insieme di chiavi
+                    (record con colonne diverse finiscono in gruppi diversi, nessuna chiave viene scartata)
+    :param ricostruisci_indici: Elimina gli indici non unici della tabella prima del caricamento e li ricrea
+                                alla fine; quelli che non si riesce a ricreare sono in 'indici_non_ricostruiti'
+    :param profilo: Profilo SQLite da applicare durante il caricamento (None = lascia quello corrente)
+    :return: Righe inserite (totali e per gruppo di colonne), blocchi, durata e righe al secondo
+    """
+    inizio = time.perf_counter()
+    conn = connessione()
+    inserite = 0
+    confermate = 0
+    gruppi = {}  # colonne -> righe inserite
+    blocchi_eseguiti = 0
+    indici = []
+    non_ricostruiti = []
+    blocco_singolo = dimensione_blocco is None
+    dimensione = dimensione_blocco or DIMENSIONE_BLOCCO_CARICAMENTO
+
+    try:
+        with (profilo_temporaneo(profilo) if profilo else _nessun_profilo()):
+            if ricostruisci_indici:
+                indici = _indici_utente(conn, nome_tabella)
+                for nome_indice, _ in indici:
+                    conn.execute(f'DROP INDEX IF EXISTS "{nome_indice}"')
+
+            try:
+                conn.execute("BEGIN")
+                for blocco in _blocchi(righe, dimensione):
+                    for firma, valori in _raggruppa_per_colonne(blocco, colonne):
+                        conn.executemany(_query_inserimento(nome_tabella, firma), valori)
+                        gruppi[firma] = gruppi.get(firma, 0) + len(valori)
+                    inserite += len(blocco)
+                    blocchi_eseguiti += 1
+                    if not blocco_singolo:
+                        conn.commit()
+                        confermate = inserite
+                        conn.execute("BEGIN")
+                conn.commit()
+                confermate = inserite
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                # Gli indici vengono ricreati anche se il caricamento si interrompe,
+                # ognuno per conto suo: un errore su uno non deve far perdere gli altri
+                for nome_indice, sql in indici:
+                    try:
+                        conn.execute(sql)
+                    except sqlite3.Error as e:
+                        non_ricostruiti.append({"nome": nome_indice, "sql": sql, "errore": str(e)})
+                        print(f"[DEBUG] Indice '{nome_indice}' non ricostruito: {e}")
+                if indici:
+                    catalogo.invalida()
+                cache_query.registra_scrittura(tabelle=[nome_tabella])
+    except Exception as e:
+        # affected_rows indica le righe già confermate dai blocchi completati
+        return {"success": False, "error": str(e), "affected_rows": confermate,
+                "indici_non_ricostruiti": non_ricostruiti}
+
+    durata = time.perf_counter() - inizio
+    return {
+        "success": True,
+        "affected_rows": inserite,
+        "indici_non_ricostruiti": non_ricostruiti,
+        "gruppi": [{"colonne": list(firma), "righe": n} for firma, n in gruppi.items()],
+        "blocchi": blocchi_eseguiti,
+        "secondi": round(durata, 3),
+        "righe_al_secondo": round(inserite / durata) if durata > 0 else inserite
+    }
+
+
+@contextmanager
+def _nessun_profilo():
+    yield connessione()
+
+
 def inserisci_dati(nome_tabella, dati):
     """
     Inserisce uno o più record in una tabella.
@@ -69,26 +1097,12 @@ def inserisci_dati(nome_tabella, dati):
         if isinstance(dati, list):
             if not dati:
                 return {"success": False, "error": "Lista vuota"}
-            
-            colonne = list(dati[0].keys())
-            valori = [tuple(item.get(col) for col in colonne) for item in dati]
-            placeholders = ','.join(['?' for _ in colonne])
-            query = f"INSERT INTO {nome_tabella} ({','.join(colonne)}) VALUES ({placeholders})"
-            
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.executemany(query, valori)
-                conn.commit()
-            
-            return {"success": True, "affected_rows": len(valori)}
+            # Tutti i record in un'unica transazione
+            return carica_in_blocco(nome_tabella, dati, dimensione_blocco=None, profilo=None)
 
         # Caso: singolo record
         elif isinstance(dati, dict):
-            colonne = list(dati.keys())
-            valori = list(dati.values())
-            placeholders = ','.join(['?' for _ in valori])
-            query = f"INSERT INTO {nome_tabella} ({','.join(colonne)}) VALUES ({placeholders})"
-            return esegui_query(query, valori)
+            return carica_in_blocco(nome_tabella, [dati], dimensione_blocco=None, profilo=None)
 
         # Caso: formato non valido
         else:
@@ -97,6 +1111,188 @@ def inserisci_dati(nome_tabella, dati):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+# Numeri scritti in forma canonica: niente zeri iniziali ("00123" è un codice, non un numero),
+# niente "+", "_", "nan" o "inf" che int() e float() accetterebbero
+_TESTO_INTERO = re.compile(r"-?(?:0|[1-9][0-9]*)")
+_TESTO_DECIMALE = re.compile(r"-?(?:0|[1-9][0-9]*)?\.[0-9]+(?:[eE][-+]?[0-9]+)?|-?(?:0|[1-9][0-9]*)[eE][-+]?[0-9]+")
+
+
+def _affinita(tipo_dichiarato):
+    """Affinità SQLite di un tipo dichiarato (regole di 'Datatypes In SQLite'); None se non dichiarato"""
+    tipo = (tipo_dichiarato or "").upper()
+    if not tipo:
+        return None
+    if "INT" in tipo:
+        return "INTEGER"
+    if "CHAR" in tipo or "CLOB" in tipo or "TEXT" in tipo:
+        return "TEXT"
+    if "BLOB" in tipo:
+        return "BLOB"
+    if "REAL" in tipo or "FLOA" in tipo or "DOUB" in tipo:
+        return "REAL"
+    return "NUMERIC"
+
+
+def _tipo_valore(valore):
+    """Tipo SQLite di un valore di esempio (stringhe CSV comprese)"""
+    if valore is None or valore == "":
+        return None
+    if isinstance(valore, bool) or isinstance(valore, int):
+        return "INTEGER"
+    if isinstance(valore, float):
+        return "REAL"
+    if isinstance(valore, (dict, list)):
+        return "TEXT"
+    testo = str(valore).strip()
+    if _TESTO_INTERO.fullmatch(testo):
+        return "INTEGER"
+    if _TESTO_DECIMALE.fullmatch(testo):
+        return "REAL"
+    return "TEXT"
+
+
+def _unisci_tipi(attuale, nuovo):
+    """INTEGER < REAL < TEXT: il tipo di una colonna è il più generale visto nel campione"""
+    ordine = {None: 0, "INTEGER": 1, "REAL": 2, "TEXT": 3}
+    return attuale if ordine[attuale] >= ordine[nuovo] else nuovo
+
+
+def _converti_csv(valore, tipo):
+    """
+    Converte una cella CSV nel tipo della colonna; stringa vuota = NULL.
+    Solo i numeri in forma canonica vengono convertiti, il resto resta testo.
+    """
+    if valore == "":
+        return None
+    if tipo in ("INTEGER", "REAL", "NUMERIC"):
+        trovato = _tipo_valore(valore)
+        if trovato == "INTEGER":
+            return float(valore) if tipo == "REAL" else int(valore)
+        if trovato == "REAL":
+            return float(valore)
+    return valore
+
+
+def _valore_jsonl(valore):
+    """Oggetti e liste annidati vengono salvati come testo JSON"""
+    if isinstance(valore, (dict, list)):
+        return json.dumps(valore, ensure_ascii=False)
+    return valore
+
+
+def importa_tabella(nome_tabella, file_origine, formato=None, crea_tabella_se_manca=True,
+                    campione=1000, dimensione_blocco=DIMENSIONE_BLOCCO_CARICAMENTO, delimitatore=";"):
+    """
+    Importa un file CSV o JSON Lines in una tabella, leggendolo in streaming.
+    I tipi delle colonne sono dedotti dalle prime 'campione' righe; se la tabella non esiste
+    viene creata, poi le righe sono inserite a blocchi con carica_in_blocco.
+    Se la tabella esiste, le celle CSV sono convertite secondo i tipi dichiarati delle sue colonne.
+    Una riga CSV con un numero di campi diverso dall'intestazione interrompe l'importazione
+    indicandone il numero (non viene completata con NULL): i blocchi già caricati restano confermati
+    e, se non ne è stato confermato nessuno, la tabella creata da questa chiamata viene eliminata.
+    :param nome_tabella: Tabella di destinazione
+    :param file_origine: Percorso del file da importare
+    :param formato: 'csv' o 'jsonl' (se None viene dedotto dall'estensione)
+    :param delimitatore: Separatore del CSV, di default ';' come in esporta_tabella
+    """
+    try:
+        if formato is None:
+            formato = "jsonl" if file_origine.lower().endswith((".jsonl", ".ndjson")) else "csv"
+        formato = formato.lower()
+        if formato not in ("csv", "jsonl"):
+            return {"success": False, "error": f"Formato di importazione non supportato: {formato}"}
+
+        info = catalogo.tabella(nome_tabella)
+        # Affinità delle colonne già esistenti (None = tipo non dichiarato, si usa quello dedotto)
+        affinita = {col["name"].lower(): _affinita(col["type"]) for col in info["columns"]} if info else {}
+
+        with open(file_origine, "r", newline="", encoding="utf-8-sig") as f:
+            if formato == "csv":
+                reader = csv.reader(f, delimiter=delimitatore)
+                intestazione = next(reader, None)
+                if not intestazione:
+                    return {"success": False, "error": "Il file CSV è vuoto"}
+                colonne = [col.strip() for col in intestazione]
+
+                def righe_csv():
+                    for riga in reader:
+                        if not riga:
+                            continue
+                        if len(riga) != len(colonne):
+                            raise ValueError(
+                                f"Riga {reader.line_num}: attese {len(colonne)} colonne, trovate {len(riga)}"
+                            )
+                        yield riga
+
+                sorgente = righe_csv()
+                esempio = list(itertools.islice(sorgente, campione))
+                tipi = {col: None for col in colonne}
+                for riga in esempio:
+                    for col, valore in zip(colonne, riga):
+                        tipi[col] = _unisci_tipi(tipi[col], _tipo_valore(valore))
+                for col in colonne:
+                    if affinita.get(col.lower()) not in (None, "BLOB"):
+                        tipi[col] = affinita[col.lower()]
+                elenco_tipi = [tipi[col] for col in colonne]
+                righe = (
+                    tuple(_converti_csv(valore, tipo) for valore, tipo in zip(riga, elenco_tipi))
+                    for riga in itertools.chain(esempio, sorgente)
+                )
+                colonne_inserimento = colonne
+            else:
+                def oggetti():
+                    for numero, linea in enumerate(f, start=1):
+                        linea = linea.strip()
+                        if not linea:
+                            continue
+                        oggetto = json.loads(linea)
+                        if not isinstance(oggetto, dict):
+                            raise ValueError(f"Riga {numero}: atteso un oggetto JSON")
+                        yield {k: _valore_jsonl(v) for k, v in oggetto.items()}
+
+                sorgente = oggetti()
+                esempio = list(itertools.islice(sorgente, campione))
+                tipi = {}
+                for oggetto in esempio:
+                    for col, valore in oggetto.items():
+                        tipi[col] = _unisci_tipi(tipi.get(col), _tipo_valore(valore))
+                colonne = list(tipi)
+                righe = itertools.chain(esempio, sorgente)
+                # Record con chiavi diverse vengono raggruppati da carica_in_blocco
+                colonne_inserimento = None
+
+            tabella_creata = False
+            if info is None:
+                if not crea_tabella_se_manca:
+                    return {"success": False, "error": f"La tabella '{nome_tabella}' non esiste"}
+                if not colonne:
+                    return {"success": False, "error": "Nessuna colonna trovata nel file"}
+                definizioni = [f'"{col}" {tipi[col] or "TEXT"}' for col in colonne]
+                creazione = crea_tabella(nome_tabella, definizioni)
+                if not creazione["success"]:
+                    return creazione
+                tabella_creata = True
+
+            risultato = carica_in_blocco(nome_tabella, righe, dimensione_blocco=dimensione_blocco,
+                                         colonne=colonne_inserimento)
+
+        if not risultato["success"]:
+            if tabella_creata and not risultato["affected_rows"]:
+                # Nessun blocco confermato: la tabella creata per questa importazione resterebbe vuota
+                elimina_tabella(nome_tabella)
+            return risultato
+        risultato["message"] = (
+            f"Importate {risultato['affected_rows']} righe da {file_origine} nella tabella '{nome_tabella}'"
+            + (" (tabella creata)" if tabella_creata else "")
+        )
+        risultato["colonne"] = {col: tipi[col] or "TEXT" for col in colonne}
+        risultato["tabella_creata"] = tabella_creata
+        return risultato
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 def elimina_tabella(nome_tabella):
     """
     Elimina completamente una tabella dal database.
@@ -105,6 +1301,7 @@ def elimina_tabella(nome_tabella):
     try:
         query = f"DROP TABLE IF EXISTS {nome_tabella}"
         risultato = esegui_query(query)
+        catalogo.invalida()
         if risultato["success"]:
             return {"success": True, "message": f"Tabella '{nome_tabella}' eliminata con successo."}
         else:
@@ -122,7 +1319,12 @@ def aggiorna_dati(nome_tabella, dati, condizione):
     try:
         set_clause = ','.join([f"{k}=?" for k in dati.keys()])
         query = f"UPDATE {nome_tabella} SET {set_clause} WHERE {condizione}"
-        return esegui_query(query, list(dati.values()))
+        inizio = time.perf_counter()
+        risultato = esegui_query(query, list(dati.values()))
+        if risultato["success"]:
+            consulente_indici.osserva(nome_tabella, condizione, query, list(dati.values()),
+                                      time.perf_counter() - inizio)
+        return risultato
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -134,22 +1336,31 @@ def elimina_dati(nome_tabella, condizione):
     """
     try:
         query = f"DELETE FROM {nome_tabella} WHERE {condizione}"
-        return esegui_query(query)
+        inizio = time.perf_counter()
+        risultato = esegui_query(query)
+        if risultato["success"]:
+            consulente_indici.osserva(nome_tabella, condizione, query, None, time.perf_counter() - inizio)
+        return risultato
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def consulta_tabella(nome_tabella, colonne="*", condizione=None):
+def consulta_tabella(nome_tabella, colonne="*", condizione=None, formato="dizionari"):
     """
     Consulta dati in una tabella
     :param nome_tabella: Nome della tabella
     :param colonne: Stringhe delle colonne da selezionare, default "*"
     :param condizione: Stringa con la condizione WHERE opzionale
+    :param formato: 'dizionari' o 'colonnare' (vedi esegui_query)
     """
     try:
         query = f"SELECT {colonne} FROM {nome_tabella}"
         if condizione:
             query += f" WHERE {condizione}"
-        result = esegui_query(query)
+        inizio = time.perf_counter()
+        result = esegui_query(query, formato=formato, cache=True)
+        # Un risultato dalla cache non dice nulla sul costo della query
+        if result["success"] and not result["da_cache"]:
+            consulente_indici.osserva(nome_tabella, condizione, query, None, time.perf_counter() - inizio)
         # Garantiamo sempre una lista anche se nulla viene trovato
         if result["success"] and result["data"] is None:
             result["data"] = []
@@ -157,20 +1368,435 @@ def consulta_tabella(nome_tabella, colonne="*", condizione=None):
     except Exception as e:
         return {"success": False, "error": str(e), "data": []}
 
+# Funzioni di aggregazione consentite in aggrega_tabella (anche con i nomi italiani)
+FUNZIONI_AGGREGAZIONE = {
+    "count": "COUNT", "conta": "COUNT",
+    "sum": "SUM", "somma": "SUM",
+    "avg": "AVG", "media": "AVG",
+    "min": "MIN", "minimo": "MIN",
+    "max": "MAX", "massimo": "MAX",
+    "total": "TOTAL",
+    "group_concat": "GROUP_CONCAT"
+}
+OPERATORI_FILTRO = {"=", "==", "!=", "<>", "<", "<=", ">", ">=", "LIKE", "NOT LIKE", "IN", "NOT IN",
+                    "IS NULL", "IS NOT NULL"}
+
+_ALIAS = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_AGGREGAZIONE_TESTO = re.compile(
+    r"^\s*(\w+)\s*\(\s*(DISTINCT\s+)?(\*|[A-Za-z_][A-Za-z0-9_]*)\s*\)\s*(?:AS\s+([A-Za-z_][A-Za-z0-9_]*))?\s*$",
+    re.IGNORECASE
+)
+
+
+def _aggregazione(voce):
+    """Normalizza un'aggregazione: dizionario {"funzione", "colonna", "alias", "distinct"} o testo 'sum(totale) AS t'"""
+    if isinstance(voce, dict):
+        return {
+            "funzione": str(voce.get("funzione", "")).lower(),
+            "colonna": voce.get("colonna") or "*",
+            "alias": voce.get("alias"),
+            "distinct": bool(voce.get("distinct", False))
+        }
+    corrispondenza = _AGGREGAZIONE_TESTO.match(str(voce))
+    if corrispondenza is None:
+        raise ValueError(f"Aggregazione non valida: {voce}")
+    funzione, distinct, colonna, alias = corrispondenza.groups()
+    return {"funzione": funzione.lower(), "colonna": colonna, "alias": alias, "distinct": bool(distinct)}
+
+
+def _compila_filtri(filtri, risolvi, parametri):
+    """
+    Compila una lista di filtri {"colonna", "operatore", "valore"} in SQL con segnaposto,
+    uniti in AND; 'risolvi' trasforma il nome indicato nell'espressione SQL corrispondente
+    """
+    if isinstance(filtri, dict):
+        filtri = [filtri]
+    if not isinstance(filtri, (list, tuple)):
+        raise ValueError("I filtri devono essere una lista di oggetti {\"colonna\", \"operatore\", \"valore\"}")
+    clausole = []
+    for filtro in filtri:
+        if not isinstance(filtro, dict):
+            raise ValueError(f"Filtro non valido: {filtro!r}, atteso {{\"colonna\", \"operatore\", \"valore\"}}")
+        espressione = risolvi(filtro.get("colonna", ""))
+        operatore = " ".join(str(filtro.get("operatore", "=")).upper().split())
+        if operatore not in OPERATORI_FILTRO:
+            raise ValueError(f"Operatore non consentito: {filtro.get('operatore')}")
+        if operatore in ("IS NULL", "IS NOT NULL"):
+            clausole.append(f"{espressione} {operatore}")
+        elif operatore in ("IN", "NOT IN"):
+            valori = filtro.get("valore")
+            valori = list(valori) if isinstance(valori, (list, tuple)) else [valori]
+            if not valori:
+                raise ValueError(f"Lista di valori vuota per {operatore}")
+            clausole.append(f"{espressione} {operatore} ({', '.join('?' * len(valori))})")
+            parametri.extend(valori)
+        else:
+            clausole.append(f"{espressione} {operatore} ?")
+            parametri.append(filtro.get("valore"))
+    return " AND ".join(clausole)
+
+
+def aggrega_tabella(nome_tabella, gruppi=None, aggregazioni=None, condizione=None, having=None,
+                    ordina=None, limite=None):
+    """
+    Aggregazione eseguita da SQLite: restituisce solo le righe aggregate, non la tabella.
+    :param gruppi: Colonne del GROUP BY (lista di nomi)
+    :param aggregazioni: Lista di {"funzione", "colonna", "alias", "distinct"} o di testi come "sum(totale) AS t";
+                         default un conteggio delle righe
+    :param condizione: Filtro WHERE: stringa SQL come in consulta_tabella,
+                       oppure lista di {"colonna", "operatore", "valore"} compilata con parametri
+    :param having: Lista di {"colonna", "operatore", "valore"} su alias delle aggregazioni o colonne di gruppo
+    :param ordina: Lista di "alias DESC" o {"colonna", "direzione"}
+    :param limite: Numero massimo di righe restituite
+    :return: {"success", "data", "sql"}
+    """
+    try:
+        info = catalogo.tabella(nome_tabella)
+        if info is None:
+            return {"success": False, "error": f"Tabella '{nome_tabella}' non trovata"}
+        nomi = {col["name"].lower(): col["name"] for col in info["columns"]}
+
+        def colonna_tabella(nome):
+            colonna = nomi.get(str(nome).strip().strip('"').lower())
+            if colonna is None:
+                raise ValueError(f"Colonna '{nome}' non trovata in '{info['name']}'")
+            return f'"{colonna}"'
+
+        if isinstance(gruppi, str):
+            gruppi = [g for g in (p.strip() for p in gruppi.split(",")) if g]
+        gruppi_sql = [colonna_tabella(g) for g in (gruppi or [])]
+
+        # Espressione SQL di ogni nome utilizzabile in HAVING e ORDER BY
+        espressioni = {g.strip('"').lower(): g for g in gruppi_sql}
+        selezione = list(gruppi_sql)
+        for voce in aggregazioni or [{"funzione": "count", "colonna": "*", "alias": "conteggio"}]:
+            aggregazione = _aggregazione(voce)
+            funzione = FUNZIONI_AGGREGAZIONE.get(aggregazione["funzione"])
+            if funzione is None:
+                raise ValueError(f"Funzione di aggregazione non consentita: {aggregazione['funzione']}")
+            if aggregazione["colonna"] == "*":
+                if funzione != "COUNT":
+                    raise ValueError(f"{funzione}(*) non è valido, indicare una colonna")
+                argomento = "*"
+            else:
+                argomento = colonna_tabella(aggregazione["colonna"])
+                if aggregazione["distinct"]:
+                    argomento = f"DISTINCT {argomento}"
+            espressione = f"{funzione}({argomento})"
+            alias = aggregazione["alias"] or (
+                f"{aggregazione['funzione']}_{aggregazione['colonna']}" if aggregazione["colonna"] != "*"
+                else "conteggio"
+            ).lower()
+            if not _ALIAS.match(alias):
+                raise ValueError(f"Alias non valido: {alias}")
+            espressioni[alias.lower()] = espressione
+            selezione.append(f'{espressione} AS "{alias}"')
+
+        def risolvi_risultato(nome):
+            espressione = espressioni.get(str(nome).strip().strip('"').lower())
+            if espressione is None:
+                raise ValueError(f"'{nome}' non è né una colonna di gruppo né un alias di aggregazione")
+            return espressione
+
+        parametri = []
+        query = f"SELECT {', '.join(selezione)} FROM \"{info['name']}\""
+        filtro_where = None
+        if condizione:
+            filtro_where = condizione if isinstance(condizione, str) else _compila_filtri(condizione, colonna_tabella, parametri)
+            query += f" WHERE {filtro_where}"
+        if gruppi_sql:
+            query += f" GROUP BY {', '.join(gruppi_sql)}"
+        if having:
+            query += f" HAVING {_compila_filtri(having, risolvi_risultato, parametri)}"
+        if ordina:
+            if isinstance(ordina, (str, dict)):
+                ordina = [ordina]
+            termini = []
+            for voce in ordina:
+                if isinstance(voce, dict):
+                    nome, direzione = voce.get("colonna", ""), str(voce.get("direzione", "ASC"))
+                else:
+                    parti = str(voce).split()
+                    nome, direzione = (parti[0] if parti else ""), (parti[1] if len(parti) > 1 else "ASC")
+                direzione = direzione.upper()
+                if direzione not in ("ASC", "DESC"):
+                    raise ValueError(f"Direzione di ordinamento non valida: {direzione}")
+                termini.append(f"{risolvi_risultato(nome)} {direzione}")
+            query += f" ORDER BY {', '.join(termini)}"
+        if limite is not None:
+            query += " LIMIT ?"
+            parametri.append(int(limite))
+
+        inizio = time.perf_counter()
+        risultato = esegui_query(query, parametri, cache=True)
+        if risultato["success"] and not risultato["da_cache"]:
+            consulente_indici.osserva(info["name"], filtro_where, query, parametri, time.perf_counter() - inizio)
+            risultato["sql"] = query
+        return risultato
+    except (ValueError, TypeError) as e:
+        return {"success": False, "error": str(e)}
+
+
+# Righe mostrate per pagina quando una tabella viene consultata dalla chat
+DIMENSIONE_PAGINA = int(os.getenv("DIMENSIONE_PAGINA", "100"))
+
+
+def _colonne_sql(colonne):
+    """Accetta le colonne come stringa SQL o come lista di nomi"""
+    if isinstance(colonne, (list, tuple)):
+        return ", ".join(colonne) or "*"
+    return colonne or "*"
+
+
+def itera_tabella(nome_tabella, colonne="*", condizione=None, dimensione_blocco=1000):
+    """
+    Legge una tabella a blocchi da un cursore aperto, senza caricarla tutta in memoria.
+    Genera liste di al massimo 'dimensione_blocco' righe (dizionari colonna -> valore).
+    """
+    query = f"SELECT {_colonne_sql(colonne)} FROM {nome_tabella}"
+    if condizione:
+        query += f" WHERE {condizione}"
+    cursor = connessione().execute(query)
+    try:
+        nomi = [d[0] for d in cursor.description]
+        while True:
+            righe = cursor.fetchmany(dimensione_blocco)
+            if not righe:
+                break
+            yield [dict(zip(nomi, riga)) for riga in righe]
+    finally:
+        cursor.close()
+
+
+def _codifica_token(nome_tabella, ultima_chiave):
+    dati = json.dumps({"t": nome_tabella, "k": ultima_chiave}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(dati.encode("utf-8")).decode("ascii")
+
+
+def _decodifica_token(token, nome_tabella):
+    dati = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    if str(dati.get("t", "")).lower() != str(nome_tabella).lower():
+        raise ValueError("Il token di pagina appartiene a un'altra tabella")
+    return dati["k"]
+
+
+# Proiezioni e condizioni a cui non si può aggiungere la chiave di paginazione e l'ORDER BY
+_COLONNE_NON_PAGINABILI = re.compile(
+    r"^\s*(?:DISTINCT|ALL)\b|\b(?:count|sum|avg|min|max|total|group_concat)\s*\(", re.IGNORECASE
+)
+_CONDIZIONI_NON_PAGINABILI = re.compile(r"\b(?:ORDER|GROUP)\s+BY\b|\b(?:LIMIT|HAVING|WINDOW)\b", re.IGNORECASE)
+
+
+def _paginabile(colonne, condizione):
+    if _COLONNE_NON_PAGINABILI.search(_LETTERALI_SQL.sub("?", colonne)):
+        return False
+    return not (condizione and _CONDIZIONI_NON_PAGINABILI.search(_LETTERALI_SQL.sub("?", condizione)))
+
+
+def _prima_pagina(nome_tabella, colonne, condizione, limite):
+    """
+    Prima pagina letta da un cursore con itera_tabella, per le consultazioni che la paginazione
+    keyset non supporta (DISTINCT, aggregati, ORDER BY o LIMIT nella condizione, chiavi composte).
+    Non ci sono pagine successive: 'troncato' indica che esistono altre righe.
+    """
+    blocchi = itera_tabella(nome_tabella, colonne, condizione, dimensione_blocco=int(limite) + 1)
+    try:
+        righe = next(blocchi, [])
+    finally:
+        blocchi.close()
+    return {"success": True, "data": righe[:int(limite)], "pagina_successiva": None,
+            "troncato": len(righe) > int(limite)}
+
+
+def consulta_pagina(nome_tabella, colonne="*", condizione=None, limite=DIMENSIONE_PAGINA, token=None):
+    """
+    Consulta una pagina di righe con paginazione keyset (rowid > ultima chiave, non OFFSET),
+    così ogni pagina costa come la prima anche su tabelle molto grandi.
+    Se la consultazione non si può paginare restituisce solo la prima pagina (vedi _prima_pagina).
+    :param token: Token restituito dalla pagina precedente in 'pagina_successiva' (None = prima pagina)
+    :return: {"success": True, "data": [...], "pagina_successiva": token o None}
+    """
+    try:
+        colonne = _colonne_sql(colonne)
+        # Le viste non sono nel catalogo e non hanno un rowid su cui paginare
+        if token is None and (not _paginabile(colonne, condizione) or catalogo.tabella(nome_tabella) is None):
+            return _prima_pagina(nome_tabella, colonne, condizione, limite)
+        try:
+            chiave = catalogo.chiave_paginazione(nome_tabella)
+        except ValueError:
+            if token:
+                raise
+            return _prima_pagina(nome_tabella, colonne, condizione, limite)
+        query = f"SELECT {chiave} AS __chiave__, {colonne} FROM {nome_tabella}"
+        filtri = []
+        parametri = []
+        if condizione:
+            filtri.append(f"({condizione})")
+        if token:
+            filtri.append(f"{chiave} > ?")
+            parametri.append(_decodifica_token(token, nome_tabella))
+        if filtri:
+            query += " WHERE " + " AND ".join(filtri)
+        query += f" ORDER BY {chiave} LIMIT ?"
+        parametri.append(int(limite) + 1)
+
+        inizio = time.perf_counter()
+        try:
+            (nomi, righe), da_cache = cache_query.leggi(
+                query, parametri, lambda: _esegui_lettura(connessione(), query, parametri)
+            )
+        except sqlite3.Error:
+            # Es. viste senza rowid: la prima pagina si può comunque leggere senza chiave
+            if token:
+                raise
+            return _prima_pagina(nome_tabella, colonne, condizione, limite)
+        if not da_cache:
+            consulente_indici.osserva(nome_tabella, condizione, query, parametri, time.perf_counter() - inizio)
+
+        altre = len(righe) > int(limite)
+        righe = righe[:int(limite)]
+        dati = [dict(zip(nomi[1:], riga[1:])) for riga in righe]
+        successiva = _codifica_token(nome_tabella, righe[-1][0]) if altre and righe and righe[-1][0] is not None else None
+        return {"success": True, "data": dati, "pagina_successiva": successiva}
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        return {"success": False, "error": str(e), "data": []}
+
+
 def elenca_tabelle():
-    """Restituisce la lista delle tabelle nel database"""
+    """Restituisce la lista delle tabelle nel database (dal catalogo dello schema)"""
     try:
-        return esegui_query("SELECT name FROM sqlite_master WHERE type='table'")
+        return {"success": True, "data": [{"name": nome} for nome in catalogo.tabelle()]}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 def descrivi_tabella(nome_tabella):
-    """Restituisce la struttura di una tabella"""
+    """Restituisce la struttura di una tabella (dal catalogo dello schema)"""
+    try:
+        return {"success": True, "data": [dict(col) for col in catalogo.colonne(nome_tabella)]}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+_TERMINE_COLONNA = re.compile(
+    r'^\s*(?:"([^"]+)"|`([^`]+)`|\[([^\]]+)\]|([A-Za-z_][A-Za-z0-9_]*))\s*(ASC|DESC)?\s*$', re.IGNORECASE
+)
+
+
+def _termini_indice(colonne):
+    """Divide le colonne di un indice sulle virgole esterne alle parentesi (es. 'a, substr(b, 1, 3)')"""
+    if isinstance(colonne, (list, tuple)):
+        return [str(c).strip() for c in colonne if str(c).strip()]
+    termini, attuale, profondita = [], [], 0
+    for carattere in str(colonne or ""):
+        if carattere == "," and profondita == 0:
+            termini.append("".join(attuale).strip())
+            attuale = []
+            continue
+        if carattere == "(":
+            profondita += 1
+        elif carattere == ")":
+            profondita -= 1
+        attuale.append(carattere)
+    termini.append("".join(attuale).strip())
+    return [t for t in termini if t]
+
+
+def crea_indice(nome_tabella, colonne, nome_indice=None, unico=False, condizione=None, se_non_esiste=False):
+    """
+    Crea un indice e misura il tempo di costruzione
+    :param colonne: Lista (o stringa separata da virgole) di colonne, anche con ASC/DESC,
+                    o di espressioni (es. "lower(email)") per un indice su espressione
+    :param unico: True per un indice UNIQUE
+    :param condizione: Condizione WHERE opzionale per un indice parziale
+    :return: {"success", "message", "nome", "sql", "secondi"}
+    """
     try:
-        return esegui_query(f"PRAGMA table_info({nome_tabella})")
+        info = catalogo.tabella(nome_tabella)
+        if info is None:
+            return {"success": False, "error": f"Tabella '{nome_tabella}' non trovata"}
+        nomi = {col["name"].lower(): col["name"] for col in info["columns"]}
+        termini = _termini_indice(colonne)
+        if not termini or termini == ["*"]:
+            return {"success": False, "error": "Specificare le colonne dell'indice"}
+
+        sql_termini = []
+        for termine in termini:
+            corrispondenza = _TERMINE_COLONNA.match(termine)
+            if corrispondenza is None:
+                # Espressione: viene validata da SQLite alla creazione
+                sql_termini.append(termine)
+                continue
+            nome = next(g for g in corrispondenza.groups()[:4] if g is not None)
+            if nome.lower() not in nomi:
+                return {"success": False, "error": f"Colonna '{nome}' non trovata in '{info['name']}'"}
+            ordine = f" {corrispondenza.group(5).upper()}" if corrispondenza.group(5) else ""
+            sql_termini.append(f'"{nomi[nome.lower()]}"{ordine}')
+
+        if not nome_indice:
+            nome_indice = re.sub(r"[\W_]+", "_", f"idx_{info['name']}_{'_'.join(termini)}").strip("_").lower()
+        query = (f'CREATE {"UNIQUE " if unico else ""}INDEX {"IF NOT EXISTS " if se_non_esiste else ""}'
+                 f'"{nome_indice}" ON "{info["name"]}" ({", ".join(sql_termini)})')
+        if condizione:
+            query += f" WHERE {condizione}"
+
+        inizio = time.perf_counter()
+        risultato = esegui_query(query)
+        secondi = round(time.perf_counter() - inizio, 4)
+        catalogo.invalida()
+        if not risultato["success"]:
+            return risultato
+        return {
+            "success": True,
+            "message": f"Indice '{nome_indice}' creato su '{info['name']}' in {secondi} secondi.",
+            "nome": nome_indice,
+            "sql": query,
+            "secondi": secondi
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def elenca_indici(nome_tabella=None):
+    """Restituisce gli indici di una tabella, o di tutte le tabelle (dal catalogo dello schema)"""
+    try:
+        if nome_tabella:
+            info = catalogo.tabella(nome_tabella)
+            if info is None:
+                return {"success": False, "error": f"Tabella '{nome_tabella}' non trovata"}
+            tabelle = [info["name"]]
+        else:
+            tabelle = catalogo.tabelle()
+        dati = []
+        for tabella in tabelle:
+            for indice in catalogo.indici(tabella):
+                dati.append({
+                    "tabella": tabella,
+                    "nome": indice["name"],
+                    "colonne": [c if c is not None else "<espressione>" for c in indice["columns"]],
+                    "unico": indice["unique"],
+                    "parziale": indice["partial"],
+                    # 'c' = creato con CREATE INDEX, 'u'/'pk' = creato da un vincolo UNIQUE o PRIMARY KEY
+                    "origine": indice["origin"],
+                    "sql": indice["sql"]
+                })
+        return {"success": True, "data": dati}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+
+def elimina_indice(nome_indice):
+    """Elimina un indice creato con CREATE INDEX"""
+    try:
+        inizio = time.perf_counter()
+        risultato = esegui_query(f'DROP INDEX "{nome_indice}"')
+        catalogo.invalida()
+        if not risultato["success"]:
+            return risultato
+        secondi = round(time.perf_counter() - inizio, 4)
+        return {"success": True, "message": f"Indice '{nome_indice}' eliminato in {secondi} secondi."}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 def modifica_tabella(nome_tabella, operazione, **kwargs):
     """
     Modifica la struttura di una tabella esistente
@@ -178,6 +1804,13 @@ def modifica_tabella(nome_tabella, operazione, **kwargs):
     :param operazione: Tipo di modifica ('aggiungi_colonna' o 'rimuovi_colonna')
     :param kwargs: Parametri aggiuntivi (definizione_colonna per aggiungi, nome_colonna per rimuovi)
     """
+    try:
+        return _modifica_tabella(nome_tabella, operazione, **kwargs)
+    finally:
+        catalogo.invalida()
+
+
+def _modifica_tabella(nome_tabella, operazione, **kwargs):
     try:
         if operazione == "aggiungi_colonna":
             definizione_colonna = kwargs.get("definizione_colonna")
@@ -240,80 +1873,409 @@ def modifica_tabella(nome_tabella, operazione, **kwargs):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def esporta_tabella(nome_tabella, file_destinazione, formato="csv"):
+# Righe lette dal cursore per ogni blocco e dimensione del buffer di scrittura nelle esportazioni
+DIMENSIONE_BLOCCO_EXPORT = int(os.getenv("DIMENSIONE_BLOCCO_EXPORT", "5000"))
+BUFFER_EXPORT = int(os.getenv("BUFFER_EXPORT", str(1024 * 1024)))
+
+
+def _cursore_tabella(nome_tabella):
+    """Apre un cursore su tutte le righe della tabella e restituisce (cursore, nomi colonne)"""
+    cursor = connessione().execute(f"SELECT * FROM {nome_tabella}")
+    return cursor, [d[0] for d in cursor.description]
+
+
+def _esporta_csv(nome_tabella, file_destinazione, dimensione_blocco, dimensione_buffer, comprimi=False):
+    """
+    Scrive il CSV leggendo dal cursore a blocchi di dimensione fissa:
+    la memoria usata non dipende dalla dimensione della tabella.
+    Con comprimi=True il file viene compresso con gzip mentre viene scritto.
+    """
+    cursor, nomi_colonne = _cursore_tabella(nome_tabella)
+    totale = 0
+    try:
+        if comprimi:
+            f = gzip.open(file_destinazione, 'wt', newline='', encoding='utf-8', compresslevel=6)
+        else:
+            f = open(file_destinazione, 'w', newline='', encoding='utf-8', buffering=dimensione_buffer)
+        with f:
+            # Punto e virgola come separatore
+            writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(nomi_colonne)  # Scrivi intestazione
+            while True:
+                blocco = cursor.fetchmany(dimensione_blocco)
+                if not blocco:
+                    break
+                writer.writerows(blocco)
+                totale += len(blocco)
+    finally:
+        cursor.close()
+    return totale
+
+
+def _json_default(valore):
+    """I BLOB vengono scritti in JSON come stringhe base64"""
+    if isinstance(valore, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(valore)).decode("ascii")
+    return str(valore)
+
+
+def _esporta_jsonl(nome_tabella, file_destinazione, dimensione_blocco, dimensione_buffer):
+    """Scrive un oggetto JSON per riga (JSON Lines), leggendo dal cursore a blocchi"""
+    cursor, nomi_colonne = _cursore_tabella(nome_tabella)
+    totale = 0
+    try:
+        with open(file_destinazione, 'w', encoding='utf-8', buffering=dimensione_buffer) as f:
+            while True:
+                blocco = cursor.fetchmany(dimensione_blocco)
+                if not blocco:
+                    break
+                f.writelines(
+                    json.dumps(dict(zip(nomi_colonne, riga)), ensure_ascii=False, default=_json_default) + "\n"
+                    for riga in blocco
+                )
+                totale += len(blocco)
+    finally:
+        cursor.close()
+    return totale
+
+
+def _tipo_arrow(tipo_dichiarato):
+    """Tipo Arrow corrispondente all'affinità SQLite del tipo dichiarato (None = da dedurre)"""
+    return {
+        "INTEGER": pa.int64(),
+        "TEXT": pa.string(),
+        "BLOB": pa.binary(),
+        "REAL": pa.float64()
+    }.get(_affinita(tipo_dichiarato))
+
+
+_CLASSI_SQLITE = ("integer", "real", "text", "blob")
+
+
+def _classi_colonne(nome_tabella, nomi_colonne):
+    """Classi di memorizzazione (integer, real, text, blob) presenti in ogni colonna, lette in un solo passaggio"""
+    controlli = [
+        f"MAX(typeof(\"{nome}\") = '{classe}')" for nome in nomi_colonne for classe in _CLASSI_SQLITE
+    ]
+    riga = connessione().execute(f"SELECT {', '.join(controlli)} FROM {nome_tabella}").fetchone()
+    classi = {}
+    for i, nome in enumerate(nomi_colonne):
+        presenti = riga[i * len(_CLASSI_SQLITE):(i + 1) * len(_CLASSI_SQLITE)]
+        classi[nome] = {classe for classe, presente in zip(_CLASSI_SQLITE, presenti) if presente}
+    return classi
+
+
+def _tipo_arrow_colonna(classi, tipo_dichiarato):
+    """
+    Tipo Arrow di una colonna in base ai valori effettivamente memorizzati: con la tipizzazione
+    dinamica di SQLite una colonna INTEGER può contenere anche REAL o TEXT. Colonne miste con testo
+    diventano stringhe; il tipo dichiarato serve solo per le colonne vuote.
+    """
+    if not classi:
+        return _tipo_arrow(tipo_dichiarato) or pa.string()
+    if classi == {"integer"}:
+        return pa.int64()
+    if classi <= {"integer", "real"}:
+        return pa.float64()
+    if classi == {"blob"}:
+        return pa.binary()
+    return pa.string()
+
+
+def _valori_arrow(valori, tipo):
+    """Converte i valori di un blocco nel tipo Arrow scelto per la colonna"""
+    if pa.types.is_floating(tipo):
+        return [None if v is None else float(v) for v in valori]
+    if pa.types.is_string(tipo):
+        return [v if v is None or isinstance(v, str) else _json_default(v) for v in valori]
+    return list(valori)
+
+
+def _esporta_arrow(nome_tabella, file_destinazione, dimensione_blocco, formato):
+    """
+    Scrive un file Parquet o Arrow IPC a record batch, uno per blocco letto dal cursore.
+    Lo schema viene fissato prima di scrivere, con un passaggio preliminare sui tipi
+    memorizzati (vedi _tipo_arrow_colonna), così nessun blocco successivo può contraddirlo.
+    """
+    if pa is None:
+        raise RuntimeError("Il pacchetto 'pyarrow' è necessario per esportare in Parquet/Arrow (pip install pyarrow)")
+
+    tipi_dichiarati = {col["name"]: col["type"] for col in catalogo.colonne(nome_tabella)}
+    cursor, nomi_colonne = _cursore_tabella(nome_tabella)
+    totale = 0
+    writer = None
+    try:
+        classi = _classi_colonne(nome_tabella, nomi_colonne)
+        schema = pa.schema([
+            pa.field(nome, _tipo_arrow_colonna(classi[nome], tipi_dichiarati.get(nome))) for nome in nomi_colonne
+        ])
+        if formato == "parquet":
+            writer = pq.ParquetWriter(file_destinazione, schema, compression="snappy")
+        else:
+            writer = pa.ipc.new_file(file_destinazione, schema)
+        while True:
+            blocco = cursor.fetchmany(dimensione_blocco)
+            if not blocco:
+                break
+            array = [
+                pa.array(_valori_arrow(valori, campo.type), type=campo.type)
+                for campo, valori in zip(schema, zip(*blocco))
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(array, schema=schema))
+            totale += len(blocco)
+    finally:
+        cursor.close()
+        if writer is not None:
+            writer.close()
+    return totale
+
+
+def _larghezze_txt(nome_tabella, nomi_colonne, modalita, campione, dimensione_blocco):
+    """
+    Calcola la larghezza di ogni colonna del formato txt senza tenere le righe in memoria:
+    - 'due_passaggi': un primo passaggio completo sul cursore (larghezze esatte)
+    - 'sql': MAX(LENGTH(...)) calcolato da SQLite
+    - 'campione': solo le prime 'campione' righe; i valori più lunghi verranno troncati
+    """
+    larghezze = [len(col) for col in nomi_colonne]
+    if modalita == "sql":
+        # NULL viene scritto come "None" (4 caratteri)
+        espressioni = ", ".join(
+            f'MAX(COALESCE(LENGTH(CAST("{col}" AS TEXT)), 4))' for col in nomi_colonne
+        )
+        massimi = connessione().execute(f"SELECT {espressioni} FROM {nome_tabella}").fetchone()
+        return [max(l, m or 0) for l, m in zip(larghezze, massimi)]
+
+    cursor, _ = _cursore_tabella(nome_tabella)
+    try:
+        letti = 0
+        while modalita != "campione" or letti < campione:
+            blocco = cursor.fetchmany(dimensione_blocco if modalita != "campione"
+                                      else min(dimensione_blocco, campione - letti))
+            if not blocco:
+                break
+            letti += len(blocco)
+            for riga in blocco:
+                for i, val in enumerate(riga):
+                    lunghezza = len(str(val))
+                    if lunghezza > larghezze[i]:
+                        larghezze[i] = lunghezza
+    finally:
+        cursor.close()
+    return larghezze
+
+
+def _esporta_txt(nome_tabella, file_destinazione, modalita, campione, dimensione_blocco, dimensione_buffer):
+    """
+    Scrive il formato testo tabulare riga per riga: prima calcola le larghezze
+    (vedi _larghezze_txt), poi un secondo cursore scrive i dati a blocchi.
+    """
+    if modalita not in ("due_passaggi", "sql", "campione"):
+        raise ValueError(f"Modalità txt non supportata: {modalita}")
+
+    cursor, nomi_colonne = _cursore_tabella(nome_tabella)
+    try:
+        larghezze = _larghezze_txt(nome_tabella, nomi_colonne, modalita, campione, dimensione_blocco)
+    except Exception:
+        cursor.close()
+        raise
+    sep = "+" + "+".join("-" * (larghezza + 2) for larghezza in larghezze) + "+"
+
+    def cella(val, larghezza):
+        testo = str(val)
+        if len(testo) > larghezza:
+            testo = testo[:max(larghezza - 1, 0)] + "…"
+        return f" {testo:<{larghezza}} |"
+
+    totale = 0
+    try:
+        with open(file_destinazione, 'w', encoding='utf-8', buffering=dimensione_buffer) as f:
+            # Intestazione
+            f.write(sep + "\n")
+            f.write("|" + "".join(cella(col, larghezza) for col, larghezza in zip(nomi_colonne, larghezze)) + "\n")
+            f.write(sep)
+
+            # Dati
+            while True:
+                blocco = cursor.fetchmany(dimensione_blocco)
+                if not blocco:
+                    break
+                for riga in blocco:
+                    f.write("\n|" + "".join(cella(val, larghezza) for val, larghezza in zip(riga, larghezze)))
+                totale += len(blocco)
+            f.write("\n" + sep)
+    finally:
+        cursor.close()
+    return totale
+
+
+def esporta_tabella(nome_tabella, file_destinazione, formato="csv",
+                    dimensione_blocco=DIMENSIONE_BLOCCO_EXPORT, dimensione_buffer=BUFFER_EXPORT,
+                    modalita_txt="due_passaggi", campione=1000):
     """
     Esporta i dati di una tabella in un file di testo
     :param nome_tabella: Nome della tabella da esportare
     :param file_destinazione: Percorso completo del file di destinazione
-    :param formato: Formato di esportazione ('csv' o 'txt')
+    :param formato: Formato di esportazione ('csv', 'csv.gz', 'jsonl', 'txt',
+                    oppure 'parquet'/'arrow' se pyarrow è installato)
+    :param dimensione_blocco: Righe lette dal cursore per volta
+    :param dimensione_buffer: Byte del buffer di scrittura del file
+    :param modalita_txt: Calcolo delle larghezze per 'txt': 'due_passaggi', 'sql' o 'campione'
+    :param campione: Righe esaminate con modalita_txt='campione'
     :return: Dizionario con il risultato dell'operazione
     """
     try:
-        # Ottieni i dati dalla tabella
-        risultato = consulta_tabella(nome_tabella)
-        if not risultato["success"]:
-            return risultato
-
-        # Ottieni la struttura della tabella per i nomi delle colonne
-        struttura = descrivi_tabella(nome_tabella)
-        if not struttura["success"]:
-            return struttura
-
-        # Estrai i nomi delle colonne
-        nomi_colonne = [col["name"] for col in struttura["data"]]
-        
         # Assicurati che la directory di destinazione esista
-        os.makedirs(os.path.dirname(file_destinazione), exist_ok=True)
-        
-        if formato.lower() == "csv":
-            # Usa il modulo csv per gestire l'output CSV con punto e virgola come separatore
-            with open(file_destinazione, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-                writer.writerow(nomi_colonne)  # Scrivi intestazione
-                
-                # Scrivi i dati
-                for riga in risultato["data"]:
-                    writer.writerow([riga.get(col, "") for col in nomi_colonne])
-                    
+        cartella = os.path.dirname(file_destinazione)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+
+        formato = formato.lower()
+        if formato == "csv":
+            totale = _esporta_csv(nome_tabella, file_destinazione, dimensione_blocco, dimensione_buffer)
+        elif formato == "csv.gz":
+            totale = _esporta_csv(nome_tabella, file_destinazione, dimensione_blocco, dimensione_buffer,
+                                  comprimi=True)
+        elif formato == "jsonl":
+            totale = _esporta_jsonl(nome_tabella, file_destinazione, dimensione_blocco, dimensione_buffer)
+        elif formato in ("parquet", "arrow"):
+            totale = _esporta_arrow(nome_tabella, file_destinazione, dimensione_blocco, formato)
         else:
             # Formato testo tabulare
-            larghezze = {col: len(col) for col in nomi_colonne}
-            for riga in risultato["data"]:
-                for col in nomi_colonne:
-                    larghezze[col] = max(larghezze[col], len(str(riga.get(col, ""))))
-
-            # Prepara le linee di output
-            linee = []
-            sep = "+" + "+".join("-" * (larghezze[col] + 2) for col in nomi_colonne) + "+"
-            
-            # Intestazione
-            linee.append(sep)
-            header = "|"
-            for col in nomi_colonne:
-                header += f" {col:<{larghezze[col]}} |"
-            linee.append(header)
-            linee.append(sep)
-            
-            # Dati
-            for riga in risultato["data"]:
-                line = "|"
-                for col in nomi_colonne:
-                    val = str(riga.get(col, ""))
-                    line += f" {val:<{larghezze[col]}} |"
-                linee.append(line)
-            linee.append(sep)
-            
-            # Scrivi il file
-            with open(file_destinazione, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(linee))
-
+            totale = _esporta_txt(nome_tabella, file_destinazione, modalita_txt, campione,
+                                  dimensione_blocco, dimensione_buffer)
         return {
             "success": True,
-            "message": f"Tabella esportata con successo in {file_destinazione}"
+            "message": f"Tabella esportata con successo in {file_destinazione}",
+            "righe": totale
         }
 
     except Exception as e:
         return {
             "success": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+
+# Estensione dei file prodotti da esporta_database per ogni formato
+ESTENSIONI_EXPORT = {
+    "csv": "csv",
+    "csv.gz": "csv.gz",
+    "jsonl": "jsonl",
+    "txt": "txt",
+    "parquet": "parquet",
+    "arrow": "arrow"
+}
+
+
+def _esporta_in_worker(percorso_db, nome_tabella, file_destinazione, formato):
+    """
+    Esporta una tabella dentro un worker del pool; ogni worker usa la propria connessione.
+    Nei processi figli DB_PATH viene impostato esplicitamente (percorso_db), nei thread è già quello corrente.
+    """
+    global DB_PATH
+    if percorso_db is not None:
+        DB_PATH = percorso_db
+    inizio = time.perf_counter()
+    try:
+        risultato = esporta_tabella(nome_tabella, file_destinazione, formato)
+    finally:
+        if percorso_db is None:
+            # Nei thread la connessione torna subito nel pool invece di restare occupata fino alla fine
+            connessioni.restituisci()
+    return {
+        "tabella": nome_tabella,
+        "file": file_destinazione,
+        "success": risultato["success"],
+        "righe": risultato.get("righe", 0),
+        "secondi": round(time.perf_counter() - inizio, 3),
+        "error": risultato.get("error")
+    }
+
+
+def esporta_database(cartella_destinazione, tabelle=None, formato="csv", worker=None, modalita="thread"):
+    """
+    Esporta più tabelle in parallelo, una per file, e scrive un manifest.json
+    con righe e durata di ogni tabella.
+    :param cartella_destinazione: Cartella in cui creare i file
+    :param tabelle: Lista di tabelle da esportare (None = tutte tranne quelle interne di SQLite)
+    :param formato: Formato di ogni file (come in esporta_tabella)
+    :param worker: Numero di esportazioni contemporanee (default: numero di CPU); in modalità 'thread'
+                   è limitato alle connessioni ancora libere nel pool
+    :param modalita: 'thread' (default) o 'processi' (un processo per worker, sfrutta più core).
+                     Con l'avvio 'spawn' (Windows) ogni processo figlio reimporta il modulo principale,
+                     che per l'app web significa ricaricare anche il modello Whisper: usare 'processi'
+                     solo da script con un __main__ leggero.
+    """
+    try:
+        inizio = time.perf_counter()
+        formato = formato.lower()
+        if formato not in ESTENSIONI_EXPORT:
+            return {"success": False, "error": f"Formato non supportato: {formato}"}
+
+        esistenti = {nome.lower(): nome for nome in catalogo.tabelle()}
+        if tabelle:
+            mancanti = [t for t in tabelle if t.lower() not in esistenti]
+            if mancanti:
+                return {"success": False, "error": f"Tabelle inesistenti: {', '.join(mancanti)}"}
+            tabelle = [esistenti[t.lower()] for t in tabelle]
+        else:
+            tabelle = [nome for nome in esistenti.values() if not nome.lower().startswith("sqlite_")]
+        if not tabelle:
+            return {"success": False, "error": "Nessuna tabella da esportare"}
+
+        os.makedirs(cartella_destinazione, exist_ok=True)
+        percorso_db = os.path.abspath(DB_PATH)
+        worker = max(1, min(worker or os.cpu_count() or 1, len(tabelle)))
+        Esecutore = ProcessPoolExecutor if modalita == "processi" and worker > 1 else ThreadPoolExecutor
+        if Esecutore is ThreadPoolExecutor:
+            # Ogni thread apre una connessione dal pool: oltre gli slot liberi resterebbe in attesa fino al timeout
+            worker = max(1, min(worker, connessioni.slot_liberi()))
+
+        risultati = []
+        with Esecutore(max_workers=worker) as pool:
+            futuri = [
+                pool.submit(
+                    _esporta_in_worker,
+                    percorso_db if Esecutore is ProcessPoolExecutor else None,
+                    nome,
+                    os.path.join(cartella_destinazione, f"{nome}.{ESTENSIONI_EXPORT[formato]}"),
+                    formato
+                )
+                for nome in tabelle
+            ]
+            for futuro in as_completed(futuri):
+                risultati.append(futuro.result())
+        risultati.sort(key=lambda r: tabelle.index(r["tabella"]))
+
+        durata = round(time.perf_counter() - inizio, 3)
+        manifest = {
+            "database": percorso_db,
+            "creato": datetime.now().isoformat(timespec="seconds"),
+            "formato": formato,
+            "worker": worker,
+            "modalita": modalita if Esecutore is ProcessPoolExecutor else "thread",
+            "secondi_totali": durata,
+            "righe_totali": sum(r["righe"] for r in risultati),
+            "tabelle": risultati
+        }
+        percorso_manifest = os.path.join(cartella_destinazione, "manifest.json")
+        with open(percorso_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        falliti = [r for r in risultati if not r["success"]]
+        if falliti:
+            return {
+                "success": False,
+                "error": "Esportazione fallita per: " + ", ".join(f"{r['tabella']} ({r['error']})" for r in falliti),
+                "manifest": percorso_manifest
+            }
+        return {
+            "success": True,
+            "message": (f"Esportate {len(risultati)} tabelle ({manifest['righe_totali']} righe) "
+                        f"in {cartella_destinazione} in {durata} s"),
+            "manifest": percorso_manifest
+        }
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
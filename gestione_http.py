@@ -0,0 +1,289 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # client HTTP non bloccante, necessario solo per l'API asincrona
+except ImportError:
+    httpx = None
+
+# Numero massimo di connessioni keep-alive tenute aperte per host.
+# Va dimensionato sul numero di thread Flask che chiamano l'LLM in parallelo.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+_sessione = None
+_lock_sessione = threading.Lock()
+
+# Un client asincrono per ogni event loop (un AsyncClient non può essere condiviso tra loop)
+_client_async = weakref.WeakKeyDictionary()
+
+
+def sessione():
+    """
+    Restituisce la sessione HTTP condivisa (creata al primo utilizzo).
+    La sessione mantiene le connessioni aperte (keep-alive), così le chiamate
+    successive verso lo stesso host non ripetono l'handshake TCP/TLS.
+    """
+    global _sessione
+    if _sessione is None:
+        with _lock_sessione:
+            if _sessione is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    pool_block=False
+                )
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _sessione = s
+    return _sessione
+
+
+def chiudi_sessione():
+    """Chiude la sessione condivisa e tutte le connessioni nel pool"""
+    global _sessione
+    with _lock_sessione:
+        if _sessione is not None:
+            _sessione.close()
+            _sessione = None
+
+
+def client_async():
+    """
+    Restituisce il client httpx.AsyncClient condiviso dell'event loop corrente,
+    con keep-alive e lo stesso limite di connessioni del pool sincrono.
+    """
+    if httpx is None:
+        raise RuntimeError("Il pacchetto 'httpx' è necessario per l'API asincrona (pip install httpx)")
+    loop = asyncio.get_running_loop()
+    client = _client_async.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE
+            )
+        )
+        _client_async[loop] = client
+    return client
+
+
+async def chiudi_client_async():
+    """Chiude il client asincrono dell'event loop corrente"""
+    client = _client_async.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def statistiche_pool():
+    """
+    Restituisce le statistiche di riutilizzo delle connessioni per ogni pool (host).
+    'riutilizzate' è il numero di richieste servite senza aprire una nuova connessione.
+    """
+    if _sessione is None:
+        return {}
+
+    statistiche = {}
+    for adapter in set(_sessione.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for chiave in pools.keys():
+            pool = pools.get(chiave)
+            if pool is None:
+                continue
+            nome = f"{pool.scheme}://{pool.host}:{pool.port}"
+            richieste = pool.num_requests
+            connessioni = pool.num_connections
+            statistiche[nome] = {
+                "richieste": richieste,
+                "connessioni_aperte": connessioni,
+                "riutilizzate": max(richieste - connessioni, 0),
+                "dimensione_pool": pool.pool.maxsize if pool.pool is not None else HTTP_POOL_SIZE
+            }
+    return statistiche
+
+
+# Stati HTTP per cui ha senso ritentare (limite di frequenza o errore temporaneo del provider)
+STATI_RITENTABILI = {408, 425, 429, 500, 502, 503, 504}
+
+
+def errore_ritentabile(status_code, eccezione):
+    """
+    Classifica un errore: True se è temporaneo (429, 5xx, timeout, connessione),
+    False se ritentare non cambierebbe l'esito (es. 400, 401, 404).
+    """
+    if status_code is not None:
+        return status_code in STATI_RITENTABILI
+    if isinstance(eccezione, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if httpx is not None and isinstance(eccezione, (httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    return False
+
+
+def leggi_retry_after(valore):
+    """Converte l'header Retry-After (secondi o data HTTP) in secondi di attesa, o None"""
+    if not valore:
+        return None
+    try:
+        return max(float(valore), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(valore).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class PoliticaRetry:
+    """
+    Backoff esponenziale con jitter completo: l'attesa del tentativo n è casuale
+    tra 0 e min(massimo, base * 2^n). Se il server indica Retry-After, viene rispettato.
+    'budget' limita il tempo totale speso in tentativi da una singola richiesta.
+    """
+
+    def __init__(self, max_tentativi=3, base=0.5, massimo=8.0, budget=40.0):
+        self.max_tentativi = max_tentativi
+        self.base = base
+        self.massimo = massimo
+        self.budget = budget
+
+    def attesa(self, tentativo, retry_after=None):
+        attesa = random.uniform(0, min(self.massimo, self.base * (2 ** tentativo)))
+        if retry_after is not None:
+            attesa = max(attesa, retry_after)
+        return attesa
+
+    def entro_budget(self, inizio, attesa):
+        """True se dopo l'attesa resta ancora tempo per un altro tentativo"""
+        return time.monotonic() - inizio + attesa < self.budget
+
+
+class CircuitBreaker:
+    """
+    Interruttore di protezione verso il provider: dopo 'soglia' errori temporanei
+    consecutivi si apre e le richieste falliscono subito per 'tempo_apertura' secondi.
+    Scaduto il tempo lascia passare una richiesta di prova (semi-aperto):
+    se riesce si richiude, altrimenti si riapre.
+    """
+
+    def __init__(self, soglia=5, tempo_apertura=30.0):
+        self.soglia = soglia
+        self.tempo_apertura = tempo_apertura
+        self.stato = "chiuso"
+        self.errori_consecutivi = 0
+        self.aperto_da = 0.0
+        self.aperture = 0
+        self.rifiutate = 0
+        self._lock = threading.Lock()
+
+    def consenti(self):
+        """True se la richiesta può partire"""
+        with self._lock:
+            if self.stato == "chiuso":
+                return True
+            if self.stato == "aperto" and time.monotonic() - self.aperto_da >= self.tempo_apertura:
+                self.stato = "semi-aperto"
+                return True
+            self.rifiutate += 1
+            return False
+
+    def secondi_alla_riapertura(self):
+        with self._lock:
+            if self.stato != "aperto":
+                return 0.0
+            return max(self.tempo_apertura - (time.monotonic() - self.aperto_da), 0.0)
+
+    def registra_successo(self):
+        with self._lock:
+            self.stato = "chiuso"
+            self.errori_consecutivi = 0
+
+    def rilascia_prova(self):
+        """
+        Chiude una richiesta di prova finita senza esito (es. client disconnesso o errore locale):
+        il circuito torna aperto ma consente subito una nuova prova, invece di restare semi-aperto.
+        """
+        with self._lock:
+            if self.stato == "semi-aperto":
+                self.stato = "aperto"
+                self.aperto_da = time.monotonic() - self.tempo_apertura
+
+    def registra_errore(self):
+        with self._lock:
+            self.errori_consecutivi += 1
+            if self.stato == "semi-aperto" or self.errori_consecutivi >= self.soglia:
+                if self.stato != "aperto":
+                    self.aperture += 1
+                self.stato = "aperto"
+                self.aperto_da = time.monotonic()
+
+    def statistiche(self):
+        with self._lock:
+            return {
+                "stato": self.stato,
+                "errori_consecutivi": self.errori_consecutivi,
+                "aperture": self.aperture,
+                "rifiutate": self.rifiutate
+            }
+
+
+class Tentativi:
+    """
+    Ciclo di retry condiviso dalle chiamate sincrone, asincrone e in streaming:
+    per ogni tentativo fallito decide se ritentare e quanto attendere, e aggiorna il circuit breaker.
+    Va usato come context manager: qualunque sia l'uscita (return, eccezione, generatore chiuso),
+    una prova di un circuito semi-aperto rimasta senza esito viene rilasciata.
+
+        with Tentativi(politica, circuito) as tentativi:
+            for tentativo in tentativi:
+                ...
+    """
+
+    def __init__(self, politica, circuito, max_tentativi=None):
+        self.politica = politica
+        self.circuito = circuito
+        self.max_tentativi = max_tentativi or politica.max_tentativi
+        self.inizio = time.monotonic()
+        self._esito = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *eccezione):
+        if not self._esito:
+            self.circuito.rilascia_prova()
+        return False
+
+    def __iter__(self):
+        return iter(range(self.max_tentativi))
+
+    def successo(self):
+        """Il provider ha risposto: il circuito si chiude"""
+        self._esito = True
+        self.circuito.registra_successo()
+
+    def fallimento(self, tentativo, status_code, eccezione, retry_after=None, ritenta=True):
+        """
+        Registra un tentativo fallito e restituisce i secondi da attendere prima di ritentare,
+        o None se bisogna arrendersi. 'ritenta' False vieta un nuovo tentativo (es. stream già iniziato).
+        """
+        if not errore_ritentabile(status_code, eccezione):
+            if status_code is not None:
+                # Anche un 4xx dimostra che il provider è raggiungibile
+                self.successo()
+            return None
+        self._esito = True
+        self.circuito.registra_errore()
+        attesa = self.politica.attesa(tentativo, retry_after)
+        if (ritenta and tentativo < self.max_tentativi - 1
+                and self.politica.entro_budget(self.inizio, attesa) and self.circuito.consenti()):
+            print(f"Errore rete, ritento tra {attesa:.1f}s... ({tentativo+1}/{self.max_tentativi})")
+            return attesa
+        return None
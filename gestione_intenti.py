@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import threading
+
+# Il router locale può essere disattivato per forzare sempre il passaggio dall'LLM
+ROUTER_LOCALE_ATTIVO = os.getenv("ROUTER_LOCALE", "1") == "1"
+
+_IDENTIFICATORE = r"(?P<tabella>[A-Za-z_][A-Za-z0-9_]*)"
+# Un percorso è un solo token senza spazi oppure una stringa tra virgolette:
+# comandi più lunghi ("crea il file x con contenuto ...") vanno all'LLM
+_PERCORSO = r"""(?P<percorso>"[^"]+"|'[^']+'|`[^`]+`|[^\s"'`]*[^\s"'`.!])"""
+
+
+def _pulisci_percorso(percorso):
+    """Rimuove virgolette e spazi attorno a un percorso e normalizza i separatori"""
+    return percorso.strip().strip("'\"`").strip().replace("\\", "/")
+
+
+class RouterIntenti:
+    """
+    Riconosce i comandi semplici e frequenti con regole deterministiche e produce
+    lo stesso JSON d'azione che restituirebbe l'LLM, senza chiamate di rete.
+    Se nessuna regola corrisponde restituisce None e la richiesta va all'LLM.
+    """
+
+    def __init__(self):
+        self._regole = []
+        self._lock = threading.Lock()
+        self.richieste = 0
+        self.hit = 0
+        self.hit_per_regola = {}
+
+    def regola(self, nome, pattern, costruttore, per_sessione=False):
+        """
+        Registra una regola: il pattern deve coprire l'intero messaggio.
+        Con per_sessione=True il costruttore riceve anche l'id della conversazione,
+        per le regole che dipendono dal suo stato (es. la pagina successiva).
+        """
+        self._regole.append(
+            (nome, re.compile(rf"^\s*{pattern}\s*[.!]?\s*$", re.IGNORECASE), costruttore, per_sessione)
+        )
+
+    def interpreta(self, messaggio, sessione=None):
+        """Restituisce il JSON dell'azione se il messaggio corrisponde a una regola, altrimenti None"""
+        if not ROUTER_LOCALE_ATTIVO or not isinstance(messaggio, str):
+            return None
+        risultato = None
+        nome_regola = None
+        for nome, pattern, costruttore, per_sessione in self._regole:
+            corrispondenza = pattern.match(messaggio)
+            if corrispondenza:
+                risultato = costruttore(corrispondenza, sessione) if per_sessione else costruttore(corrispondenza)
+                nome_regola = nome
+                break
+
+        with self._lock:
+            self.richieste += 1
+            if risultato is not None:
+                self.hit += 1
+                self.hit_per_regola[nome_regola] = self.hit_per_regola.get(nome_regola, 0) + 1
+
+        if risultato is None:
+            return None
+        print(f"[DEBUG] Router locale: '{messaggio}' -> {nome_regola}")
+        return json.dumps(risultato, ensure_ascii=False)
+
+    def statistiche(self):
+        with self._lock:
+            return {
+                "attivo": ROUTER_LOCALE_ATTIVO,
+                "richieste": self.richieste,
+                "hit": self.hit,
+                "hit_rate": round(self.hit / self.richieste, 4) if self.richieste else 0.0,
+                "hit_per_regola": dict(self.hit_per_regola)
+            }
+
+
+router = RouterIntenti()
+
+# --- Database ---
+router.regola(
+    "elenca_tabelle",
+    r"(?:elenca|mostra|lista|mostrami|quali sono)\s+(?:tutte\s+)?(?:le\s+)?tabelle(?:\s+(?:del|nel)\s+database)?",
+    lambda m: {"azione": "elenca_tabelle"}
+)
+router.regola(
+    "descrivi_tabella",
+    rf"(?:descrivi|struttura(?:\s+della)?)\s+(?:la\s+)?tabella\s+{_IDENTIFICATORE}",
+    lambda m: {"azione": "descrivi_tabella", "nome_tabella": m.group("tabella")}
+)
+router.regola(
+    "consulta_tabella",
+    rf"(?:consulta|mostra|mostrami|visualizza)\s+(?:la\s+)?tabella\s+{_IDENTIFICATORE}",
+    lambda m: {"azione": "consulta_tabella", "nome_tabella": m.group("tabella"), "colonne": "*"}
+)
+router.regola(
+    "conta_righe",
+    rf"(?:conta\s+(?:le\s+)?righe\s+(?:della|nella)\s+tabella|quante\s+righe\s+(?:ha|ci\s+sono\s+(?:in|nella))\s+(?:la\s+)?tabella)\s+{_IDENTIFICATORE}\s*\??",
+    lambda m: {"azione": "aggrega_tabella", "nome_tabella": m.group("tabella")}
+)
+
+# --- File e cartelle ---
+router.regola(
+    "crea_cartella",
+    rf"crea\s+(?:la\s+|una\s+)?cartella\s+{_PERCORSO}",
+    lambda m: {"azione": "crea_cartella", "file": _pulisci_percorso(m.group("percorso"))}
+)
+router.regola(
+    "crea_file",
+    rf"crea\s+(?:il\s+|un\s+)?file\s+{_PERCORSO}",
+    lambda m: {"azione": "crea_file", "file": _pulisci_percorso(m.group("percorso"))}
+)
+router.regola(
+    "svuota",
+    rf"svuota\s+(?:il\s+)?file\s+{_PERCORSO}",
+    lambda m: {"azione": "svuota", "file": _pulisci_percorso(m.group("percorso"))}
+)
+router.regola(
+    "cancella_file",
+    rf"(?:cancella|elimina)\s+(?:il\s+)?file\s+{_PERCORSO}",
+    lambda m: {"azione": "cancella_file", "file": _pulisci_percorso(m.group("percorso"))}
+)
+router.regola(
+    "cancella_cartella",
+    rf"(?:cancella|elimina)\s+(?:la\s+)?cartella\s+{_PERCORSO}",
+    lambda m: {"azione": "cancella_cartella", "file": _pulisci_percorso(m.group("percorso"))}
+)
+
+
+def interpreta(messaggio, sessione=None):
+    """Scorciatoia per router.interpreta"""
+    return router.interpreta(messaggio, sessione)